@@ -1,39 +1,55 @@
 #!/usr/bin/env python3
 
-import json
+import cold_start  # first, it marks when loading the function started
 import typing
 import logging
 
 from call_next_func import post_
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import metrics
+import wire_format
 
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging()
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("???").tracer
 
-def fn(input: typing.Optional[str]) -> typing.Optional[str]:
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("???")
+INVOCATIONS = metrics.InvocationCounter()
+
+
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    chain_client.warm_up()
+
+
+def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
     """
     input:
     output:
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[??? fn] invoke count: {str(Counter.get_count())}')
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[??? fn] Parsed input: {parsed_input}')
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("???", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[??? fn] invoke count: {invoke_count}')
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[??? fn] Parsed input: %s', summarize(parsed_input))
 
             data = parsed_input.get('data', [])
             meta = parsed_input.get('meta', {})
@@ -48,23 +64,10 @@ def fn(input: typing.Optional[str]) -> typing.Optional[str]:
             except Exception as e:
                 logger.error(f'[??? fn] Error in post_: {e}')
                 post__span.set_attribute("error", True)
+                metrics.record_error("post_")
                 post__span.set_attribute("error_details", e)
 
         return str("???")
 
 
-class Counter:
-    count = None
-
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
-
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+cold_start.loaded("???", warm_up)
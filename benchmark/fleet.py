@@ -0,0 +1,59 @@
+"""
+Synthetic UAV fleets in the trajectory format of data.json, for the collision-detection benchmarks.
+"""
+import random
+
+SCENARIOS = ("dense", "sparse", "head_on")
+
+
+def _uav(index, latitude, longitude, altitude, speed, direction, vertical_speed=0):
+    return {"uav_id": f"{index:05d}", "uav_type": str(index % 2 + 1), "latitude": latitude, "longitude": longitude,
+            "altitude": altitude, "speed": speed, "direction": direction, "vertical_speed": vertical_speed}
+
+
+def dense_fleet(size, rng):
+    # a few clusters of UAVs within ~2 km of their center, most pairs are candidates and many are in conflict
+    centers = [(52.5 + rng.uniform(-0.5, 0.5), 13.4 + rng.uniform(-0.5, 0.5)) for _ in range(max(1, size // 100))]
+    fleet = []
+    for i in range(size):
+        latitude, longitude = centers[i % len(centers)]
+        fleet.append(_uav(i, latitude + rng.uniform(-0.02, 0.02), longitude + rng.uniform(-0.03, 0.03),
+                          rng.uniform(9800, 10200), rng.uniform(15, 90), rng.uniform(0, 360), rng.uniform(-5, 5)))
+    return fleet
+
+
+def sparse_fleet(size, rng):
+    # UAVs spread uniformly over a ~500 x 500 km airspace, conflicts are rare
+    return [_uav(i, rng.uniform(50.0, 54.5), rng.uniform(10.0, 17.0), rng.uniform(1000, 12000), rng.uniform(15, 90),
+                 rng.uniform(0, 360), rng.uniform(-5, 5)) for i in range(size)]
+
+
+def head_on_fleet(size, rng):
+    # pairs flying towards each other at the same altitude as in data.json, the pairs are 0.5 degrees apart
+    fleet = []
+    for i in range(size):
+        pair = i // 2
+        latitude = 50.0 + (pair % 20) * 0.5
+        longitude = 0.1 + (pair // 20) * 0.5 + (0.1 if i % 2 else 0.0)
+        fleet.append(_uav(i, latitude, longitude, 10000, 50, 270 if i % 2 else 90))
+    return fleet
+
+
+def generate_fleet(scenario, size, seed=0):
+    """
+    Args:
+        scenario: one of SCENARIOS
+        size: number of UAVs
+        seed: random seed, the same (scenario, size, seed) always gives the same fleet
+
+    Returns:
+        list of trajectory dictionaries
+    """
+    rng = random.Random(seed)
+    if scenario == "dense":
+        return dense_fleet(size, rng)
+    elif scenario == "sparse":
+        return sparse_fleet(size, rng)
+    elif scenario == "head_on":
+        return head_on_fleet(size, rng)
+    raise ValueError(f'Unknown scenario: {scenario}. Expected one of {SCENARIOS}')
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: how long each function takes to load (import fn.py in a fresh interpreter, as tinyFaaS does when
+it starts an instance) and, with --warm-up, to run its warm_up (opening the Mongo/MQTT/HTTP connections, so the
+services have to be reachable). Lists the direct imports of fn.py that take the longest, from python -X importtime.
+
+The instances are loaded with WARM_UP=off, so the load does not include the network, unless --warm-up is given.
+Other settings (MONGO_HOST, TINYFAAS_HOST, ...) are taken from the environment.
+
+usage: python benchmark/import_time.py [--functions trigger update ...] [--repeat 5] [--warm-up] [--top 8]
+                                       [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+FUNCTIONS = ["update", "trigger", "collision-detector", "mutate", "release"]
+
+# run in the directory of the function, prints the timings as JSON on the last line
+LOAD = """
+import json, time
+start = time.perf_counter()
+import fn
+loaded = time.perf_counter()
+warm_up_ms = None
+if {warm_up}:
+    fn.warm_up()
+    warm_up_ms = (time.perf_counter() - loaded) * 1000
+print(json.dumps({{"import_ms": (loaded - start) * 1000, "warm_up_ms": warm_up_ms}}))
+"""
+
+
+def load_once(function, warm_up):
+    env = dict(os.environ, WARM_UP="off", LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", LOAD.format(warm_up=warm_up)],
+                               cwd=os.path.join(REPO_DIR, function), env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'loading {function} failed:\n{completed.stderr[-2000:]}')
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(completed.stderr)
+
+
+def parse_importtime(stderr):
+    """
+    Returns:
+        {module: cumulative ms} of the modules imported directly by fn (one level below it in the import tree)
+    """
+    lines = [line for line in stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    modules, depth_of_fn = {}, None
+    for line in reversed(lines):  # importtime prints a module after its imports, so fn comes after its children
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if name == "fn":
+            depth_of_fn = depth
+            continue
+        if depth_of_fn is None:
+            continue
+        if depth <= depth_of_fn:  # before fn started importing
+            break
+        if depth == depth_of_fn + 1:
+            modules[name] = modules.get(name, 0) + int(cumulative) / 1000
+    return modules
+
+
+def benchmark(function, repeat, warm_up, top):
+    load_once(function, False)  # fills the OS file cache, as for a container that has started before
+    imports, warm_ups, modules = [], [], {}
+    for _ in range(repeat):
+        timings, run_modules = load_once(function, warm_up)
+        imports.append(timings["import_ms"])
+        if timings["warm_up_ms"] is not None:
+            warm_ups.append(timings["warm_up_ms"])
+        for name, ms in run_modules.items():
+            modules.setdefault(name, []).append(ms)
+    imports.sort()
+    warm_ups.sort()
+    slowest = sorted(((name, sorted(values)[len(values) // 2]) for name, values in modules.items()),
+                     key=lambda item: item[1], reverse=True)[:top]
+    return {"function": function, "runs": repeat, "import_p50_ms": imports[len(imports) // 2],
+            "import_min_ms": imports[0], "import_max_ms": imports[-1],
+            "warm_up_p50_ms": warm_ups[len(warm_ups) // 2] if warm_ups else None,
+            "slowest_imports_ms": dict(slowest)}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": datetime.now().isoformat(), "git_commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def print_result(result):
+    warm_up = f' warm-up p50 {result["warm_up_p50_ms"]:>8.1f}ms' if result["warm_up_p50_ms"] is not None else ''
+    print(f'{result["function"]:<20} import p50 {result["import_p50_ms"]:>8.1f}ms '
+          f'min {result["import_min_ms"]:>8.1f}ms max {result["import_max_ms"]:>8.1f}ms{warm_up}', flush=True)
+    for name, ms in result["slowest_imports_ms"].items():
+        print(f'{"":<20}   {name:<40} {ms:>8.1f}ms', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', nargs='+', default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per function')
+    parser.add_argument('--warm-up', action='store_true', help="also time fn.warm_up (needs the services)")
+    parser.add_argument('--top', type=int, default=8, help='direct imports of fn to list per function')
+    parser.add_argument('--output', help='JSON results file (default: benchmark/results/import_time-<timestamp>.json)')
+    args = parser.parse_args()
+
+    results = []
+    for function in args.functions:
+        result = benchmark(function, args.repeat, args.warm_up, args.top)
+        print_result(result)
+        results.append(result)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results',
+                                         'import_time-' + datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
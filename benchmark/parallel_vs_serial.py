@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Compares the serial and the process-pool sharded collision detection on synthetic fleets, to tell from which fleet
+size DETECTION_WORKERS > 1 (and which PARALLEL_MIN_PAIRS) is worth it on a given machine.
+
+usage: python benchmark/parallel_vs_serial.py [--engine scalar] [--scenario dense] [--workers 4]
+                                             [--sizes 100 200 500 1000 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collision-detector'))
+
+from parallel_detector import ENGINES, find_conflicts_parallel, warm_up  # noqa: E402
+from fleet import SCENARIOS, generate_fleet  # noqa: E402
+
+TIME_INTERVAL = 1; NUM_STEPS = 10; HORIZONTAL_SEPARATION = 1; VERTICAL_SEPARATION = 300  # as in collision-detector/fn.py
+
+
+def best_of(repeat, func, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', default='scalar', choices=list(ENGINES))
+    parser.add_argument('--scenario', default='dense', choices=list(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 500, 1000, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    warm_up(args.workers)  # the function keeps its pool warm, so pool start-up is not part of an invocation
+    print(f'engine={args.engine} workers={args.workers}')
+    print(f'{"uavs":>6} {"pairs":>10} {"serial [s]":>11} {"parallel [s]":>13} {"speedup":>8}')
+    for size in args.sizes:
+        fleet = generate_fleet(args.scenario, size)
+        serial, serial_conflicts = best_of(args.repeat, ENGINES[args.engine], fleet, TIME_INTERVAL, NUM_STEPS,
+                                           HORIZONTAL_SEPARATION, VERTICAL_SEPARATION)
+        parallel, parallel_conflicts = best_of(args.repeat, find_conflicts_parallel, fleet, TIME_INTERVAL, NUM_STEPS,
+                                               HORIZONTAL_SEPARATION, VERTICAL_SEPARATION, engine=args.engine,
+                                               workers=args.workers)
+        assert sorted(serial_conflicts) == parallel_conflicts, 'parallel result differs from serial'
+        print(f'{size:>6} {size * (size - 1) // 2:>10} {serial:>11.4f} {parallel:>13.4f} {serial / parallel:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
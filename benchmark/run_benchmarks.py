@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the collision-detection hot path: haversine, predict_future_positions, check_for_conflict and the
+full detection (broad phase + engine + flagging) per engine, over synthetic fleets (see fleet.py).
+
+Reports throughput, p50/p99 latency and peak memory (tracemalloc) per configuration, and writes them as JSON so runs
+can be compared over time.
+
+usage: python benchmark/run_benchmarks.py [--sizes 10 100 1000 10000] [--engines scalar vectorized cpa enu]
+                                          [--scenarios dense sparse head_on] [--repeat 5] [--output results.json]
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'collision-detector'))
+
+from utility import haversine, predict_future_positions  # noqa: E402
+from collision_detector import check_for_conflict  # noqa: E402
+from broad_phase import candidate_pairs  # noqa: E402
+from conflict_graph import flag_conflicts  # noqa: E402
+from parallel_detector import ENGINES  # noqa: E402
+from fleet import SCENARIOS, generate_fleet  # noqa: E402
+
+TIME_INTERVAL = 1; NUM_STEPS = 10; HORIZONTAL_SEPARATION = 1; VERTICAL_SEPARATION = 300  # as in collision-detector/fn.py
+MAX_PAIRS_FACTOR = {"vectorized": 25}  # the NumPy engine gets through this many times more pairs in the same time
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an already sorted list
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def measure(run, repeat, setup=lambda: None):
+    """
+    Args:
+        run: function to measure, called with the return value of setup
+        repeat: number of timed runs, after one warm-up run
+        setup: called before every run, not timed
+
+    Returns:
+        latencies of the timed runs in seconds (sorted), and the peak memory of one extra run with tracemalloc on
+    """
+    run(setup())  # warm-up
+    latencies = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        latencies.append(time.perf_counter() - start)
+    argument = setup()
+    tracemalloc.start()
+    run(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sorted(latencies), peak
+
+
+def summarize(name, config, latencies, peak_memory, operations):
+    # operations: number of unit operations (calls, pairs) per run, for the throughput
+    p50 = percentile(latencies, 50)
+    return dict(name=name, **config, runs=len(latencies), operations=operations,
+                throughput_per_s=operations / p50 if p50 > 0 else None,
+                p50_ms=p50 * 1000, p99_ms=percentile(latencies, 99) * 1000, min_ms=latencies[0] * 1000,
+                peak_memory_bytes=peak_memory)
+
+
+def micro_benchmarks(repeat):
+    fleet = generate_fleet("dense", 100)
+    positions = [predict_future_positions(aircraft, TIME_INTERVAL, NUM_STEPS) for aircraft in fleet]
+    pairs = [(i, j) for i in range(len(fleet)) for j in range(i + 1, len(fleet))]
+    results = []
+
+    def run_haversine(_):
+        for a, b in pairs:
+            haversine(fleet[a]["latitude"], fleet[a]["longitude"], fleet[b]["latitude"], fleet[b]["longitude"])
+    results.append(summarize("haversine", {}, *measure(run_haversine, repeat), operations=len(pairs)))
+
+    def run_predict(_):
+        for aircraft in fleet:
+            predict_future_positions(aircraft, TIME_INTERVAL, NUM_STEPS)
+    results.append(summarize("predict_future_positions", {"num_steps": NUM_STEPS}, *measure(run_predict, repeat),
+                             operations=len(fleet)))
+
+    def run_check(_):
+        for a, b in pairs:
+            check_for_conflict(positions[a], positions[b], HORIZONTAL_SEPARATION, VERTICAL_SEPARATION)
+    results.append(summarize("check_for_conflict", {"num_steps": NUM_STEPS}, *measure(run_check, repeat),
+                             operations=len(pairs)))
+    return results
+
+
+def detection_benchmark(scenario, size, engine, broad_phase, repeat, max_pairs):
+    config = {"scenario": scenario, "uavs": size, "engine": engine, "broad_phase": broad_phase}
+    fleet = generate_fleet(scenario, size)
+    all_pairs = size * (size - 1) // 2
+    checked_pairs = len(candidate_pairs(fleet, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                        VERTICAL_SEPARATION)) if broad_phase else all_pairs
+    if checked_pairs > max_pairs * MAX_PAIRS_FACTOR.get(engine, 1):
+        return dict(name="detect_collisions", **config, skipped=f"{checked_pairs} pairs > --max-pairs")
+
+    def run(aircraft_list):
+        pairs = None
+        if broad_phase:
+            pairs = candidate_pairs(aircraft_list, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                    VERTICAL_SEPARATION)
+        conflicts = ENGINES[engine](aircraft_list, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                    VERTICAL_SEPARATION, pairs=pairs)
+        flag_conflicts(aircraft_list, conflicts)
+        run.conflicts = len(conflicts)
+
+    result = summarize("detect_collisions", config, *measure(run, repeat, setup=lambda: copy.deepcopy(fleet)),
+                       operations=all_pairs)
+    result.update(checked_pairs=checked_pairs, conflicts=run.conflicts)
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": datetime.now().isoformat(), "git_commit": commit, "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(), "time_interval": TIME_INTERVAL,
+            "num_steps": NUM_STEPS, "horizontal_separation": HORIZONTAL_SEPARATION,
+            "vertical_separation": VERTICAL_SEPARATION}
+
+
+def print_result(result):
+    label = " ".join(f"{key}={result[key]}" for key in ("scenario", "uavs", "engine", "broad_phase") if key in result)
+    if "skipped" in result:
+        print(f'{result["name"]:<26} {label:<58} skipped ({result["skipped"]})', flush=True)
+        return
+    print(f'{result["name"]:<26} {label:<58} {result["throughput_per_s"]:>12.0f}/s p50 {result["p50_ms"]:>9.2f}ms '
+          f'p99 {result["p99_ms"]:>9.2f}ms peak {result["peak_memory_bytes"] / 2 ** 20:>7.2f}MB', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per configuration')
+    parser.add_argument('--max-pairs', type=int, default=1000000,
+                        help='skip configurations that check more pairs (x%d for vectorized)' % MAX_PAIRS_FACTOR["vectorized"])
+    parser.add_argument('--no-micro', action='store_true', help='skip the function-level micro benchmarks')
+    parser.add_argument('--output', help='JSON results file (default: benchmark/results/<timestamp>.json)')
+    args = parser.parse_args()
+
+    results = []
+    if not args.no_micro:
+        for result in micro_benchmarks(args.repeat):
+            print_result(result)
+            results.append(result)
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            for engine in args.engines:
+                for broad_phase in (False, True):
+                    result = detection_benchmark(scenario, size, engine, broad_phase, args.repeat, args.max_pairs)
+                    print_result(result)
+                    results.append(result)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, 'results',
+                                         datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+from math import radians, degrees, cos, sin, asin, floor
+from itertools import product
+
+R = 6371.0  # Radius of the Earth in kilometers, same as utility.haversine
+MIN_CELL_SIZE = 1e-9  # avoid zero-sized cells for parked aircraft and zero separations
+
+
+def separation_degrees(horizontal_separation, max_abs_latitude):
+    """
+    Returns:
+        (latitude, longitude) differences in degrees, below which two aircraft up to max_abs_latitude can be within
+        horizontal_separation
+    """
+    # haversine >= R * |dlat| and haversine >= R * 2 * asin(cos(lat) * sin(|dlon| / 2)) for the lowest cos(lat)
+    latitude_separation = degrees(horizontal_separation / R)
+    min_cos_latitude = cos(radians(max_abs_latitude))
+    half_angle = sin(horizontal_separation / (2 * R))
+    if min_cos_latitude <= half_angle:
+        return latitude_separation, 360.0  # close to the poles, any longitude can be within separation
+    return latitude_separation, degrees(2 * asin(half_angle / min_cos_latitude))
+
+
+# Broad phase: only pairs that can get close enough within the prediction horizon are handed to the narrow phase.
+def candidate_pairs(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation):
+    """
+    Bucket the aircraft into a latitude/longitude/altitude grid and return the pairs in the same or neighboring cells.
+    A cell is as large as the separation plus twice the farthest any aircraft can travel over the horizon (as
+    modelled by utility.predict_future_positions), so a pair in non-neighboring cells can never be in conflict.
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        time_interval: time interval between each step
+        num_steps: number of steps to predict
+        horizontal_separation: critical horizontal distance for conflict detection
+        vertical_separation: critical vertical distance for conflict detection
+
+    Returns:
+        sorted list of (i, j) index pairs into aircraft_list with i < j
+    """
+    if len(aircraft_list) < 2:
+        return []
+
+    horizon = max(0, num_steps - 1) * time_interval  # time of the last predicted step
+    # predict_future_positions moves the aircraft by speed (km/s) * time on the latitude and longitude axes
+    max_reach = max(aircraft["speed"] / 3600 * horizon for aircraft in aircraft_list)
+    max_vertical_reach = max(abs(aircraft["vertical_speed"]) * horizon for aircraft in aircraft_list)
+    max_abs_latitude = min(90.0, max(abs(aircraft["latitude"]) for aircraft in aircraft_list) + max_reach)
+
+    latitude_separation, longitude_separation = separation_degrees(horizontal_separation, max_abs_latitude)
+    latitude_cell = max(MIN_CELL_SIZE, 2 * max_reach + latitude_separation)
+    longitude_cell = max(MIN_CELL_SIZE, 2 * max_reach + longitude_separation)
+    altitude_cell = max(MIN_CELL_SIZE, 2 * max_vertical_reach + vertical_separation)
+    # longitude wraps around, the remainder of 360 / longitude_cell is merged into the last column
+    longitude_columns = int(360.0 // longitude_cell)
+    if longitude_columns < 3:
+        longitude_columns = 1
+
+    grid = {}
+    cells = []
+    for index, aircraft in enumerate(aircraft_list):
+        cell = (floor(aircraft["latitude"] / latitude_cell),
+                min(int((aircraft["longitude"] % 360.0) // longitude_cell), longitude_columns - 1),
+                floor(aircraft["altitude"] / altitude_cell))
+        grid.setdefault(cell, []).append(index)
+        cells.append(cell)
+
+    longitude_offsets = (0,) if longitude_columns == 1 else (-1, 0, 1)
+    pairs = []
+    for i, (lat_cell, lon_cell, alt_cell) in enumerate(cells):
+        neighbors = set()  # a set, as the wrapped longitude offsets can point to the same column
+        for dlat, dlon, dalt in product((-1, 0, 1), longitude_offsets, (-1, 0, 1)):
+            neighbors.add((lat_cell + dlat, (lon_cell + dlon) % longitude_columns, alt_cell + dalt))
+        for neighbor in neighbors:
+            pairs.extend((i, j) for j in grid.get(neighbor, ()) if j > i)
+    pairs.sort()
+    return pairs
+
+
+# Delta: after a self-report or a mutation only the changed aircraft need to be checked against the others.
+def delta_pairs(aircraft_list, changed_uav_ids, pairs=None):
+    """
+    Restrict the pairs to the ones involving a changed aircraft, O(N) pairs instead of O(N^2).
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        changed_uav_ids: uav_ids of the aircraft that changed since the last detection
+        pairs: optional sorted (i, j) index pairs with i < j to restrict, e.g. from candidate_pairs.
+            All pairs are considered if None.
+
+    Returns:
+        sorted list of (i, j) index pairs into aircraft_list with i < j, None if none of the changed aircraft are in
+        the aircraft_list (the caller should fall back to a full scan)
+    """
+    changed_uav_ids = set(changed_uav_ids)
+    changed = {index for index, aircraft in enumerate(aircraft_list) if aircraft.get("uav_id") in changed_uav_ids}
+    if not changed:
+        return None
+    if pairs is not None:
+        return [(i, j) for i, j in pairs if i in changed or j in changed]
+    return sorted({(min(i, j), max(i, j)) for i in changed for j in range(len(aircraft_list)) if j != i})
+
+
+# Context: the aircraft a group (e.g. a conflict cluster) can get close to, so a change of the group is re-checked
+# against them too.
+def pair_neighbours(pairs):
+    """
+    Args:
+        pairs: (i, j) index pairs, e.g. from candidate_pairs
+
+    Returns:
+        dict of index -> set of the indices it is paired with
+    """
+    neighbours = {}
+    for i, j in pairs:
+        neighbours.setdefault(i, set()).add(j)
+        neighbours.setdefault(j, set()).add(i)
+    return neighbours
+
+
+def group_neighbours(neighbours, indices):
+    # sorted indices paired with any of the indices, but not among them
+    indices = set(indices)
+    return sorted(set().union(*(neighbours.get(i, ()) for i in indices)) - indices)
+
+
+def reachable_neighbours(aircraft_list, indices, candidates, time_interval, num_steps, horizontal_separation,
+                         vertical_separation):
+    """
+    The candidates (e.g. the group_neighbours of a conflict cluster) that a mutation of the aircraft at indices can
+    bring into conflict. A mutation slows an aircraft down or turns it, so at each predicted step it is at most its
+    current speed * time away from where it started, in any direction, and on its altitude profile (as modelled by
+    utility.predict_future_positions). A candidate is kept if it is within that reach plus the separation of one of
+    the aircraft at the same step, with a margin for the motion between the steps (for the cpa engine).
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        indices: indices of the aircraft that may be mutated
+        candidates: indices of the other aircraft to check
+        time_interval: time interval between each step
+        num_steps: number of steps to predict
+        horizontal_separation: critical horizontal distance for conflict detection
+        vertical_separation: critical vertical distance for conflict detection
+
+    Returns:
+        list of the reachable candidates, the ones that can be reached at the earliest step first
+    """
+    if not indices or not candidates:
+        return []
+    group = [aircraft_list[i] for i in indices]
+    horizon = max(0, num_steps - 1) * time_interval
+    max_speed = max(aircraft_list[i]["speed"] for i in list(indices) + list(candidates)) / 3600
+    max_abs_latitude = min(90.0, max(abs(aircraft_list[i]["latitude"]) for i in list(indices) + list(candidates)) +
+                           max_speed * horizon)
+    latitude_separation, longitude_separation = separation_degrees(horizontal_separation, max_abs_latitude)
+    max_vertical_speed = max(abs(aircraft["vertical_speed"]) for aircraft in group)
+
+    reachable = []
+    for j in candidates:
+        candidate = aircraft_list[j]
+        speed = candidate["speed"] / 3600  # as in predict_future_positions
+        heading = radians(90 - candidate["direction"])
+        step_margin = (max_speed + speed) * time_interval / 2
+        vertical_margin = (max_vertical_speed + abs(candidate["vertical_speed"])) * time_interval / 2
+        for step in range(num_steps):
+            t = step * time_interval
+            latitude = candidate["latitude"] + speed * t * sin(heading)
+            longitude = candidate["longitude"] + speed * t * cos(heading)
+            altitude = candidate["altitude"] + candidate["vertical_speed"] * t
+            if any(abs(latitude - aircraft["latitude"]) <= aircraft["speed"] / 3600 * t + latitude_separation +
+                   step_margin and
+                   abs((longitude - aircraft["longitude"] + 180.0) % 360.0 - 180.0) <=
+                   aircraft["speed"] / 3600 * t + longitude_separation +
+                   step_margin and
+                   abs(altitude - aircraft["altitude"] - aircraft["vertical_speed"] * t) <= vertical_separation +
+                   vertical_margin
+                   for aircraft in group):
+                reachable.append((step, j))
+                break
+    return [j for _, j in sorted(reachable)]
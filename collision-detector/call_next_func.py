@@ -1,8 +1,8 @@
-import requests
 import logging
 
-host = "172.17.0.1"
-# host = "host.docker.internal"
+import chain_client
+import wire_format
+from log_setup import summarize
 
 # Set up Python logger
 # logging.basicConfig(level=logging.DEBUG)
@@ -10,17 +10,17 @@ logger = logging.getLogger(__name__)
 
 
 def post_mutate(data, meta, result):
-    url = f"http://{host}:8000/mutate"
+    url = chain_client.function_url("mutate")
     headers = {
-        "Content-Type": "application/json",
-        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response
+        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response. Content-Type is set by wire_format
 
     payload = {
         "data": data,
         "meta": meta
     }
-    logger.debug(f'[collision-detector fn] calling mutate function on {url} with payload: {payload}')
-    response = requests.post(url, headers=headers, json=payload)
+    logger.debug('[collision-detector fn] calling mutate function on %s with payload: %s', url, summarize(payload))
+    body, headers["Content-Type"] = wire_format.encode(payload)
+    response = chain_client.post("mutate", headers=headers, data=body)
     if response.status_code != 202:  # async call
         logger.error(f'[collision-detector fn] Error calling mutate function ({response.status_code}): {response.text}')
     else:
@@ -29,14 +29,14 @@ def post_mutate(data, meta, result):
 
 
 def post_release(input):
-    url = f"http://{host}:8000/release"
+    url = chain_client.function_url("release")
     headers = {
-        "Content-Type": "application/json",
-        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response
+        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response. Content-Type is set by wire_format
 
     payload = input
-    logger.debug(f'[collision-detector fn] calling release function on {url} with payload: {payload}')
-    response = requests.post(url, headers=headers, json=payload)
+    logger.debug('[collision-detector fn] calling release function on %s with payload: %s', url, summarize(payload))
+    body, headers["Content-Type"] = wire_format.encode(payload)
+    response = chain_client.post("release", headers=headers, data=body)
     if response.status_code != 202:  # async call
         logger.error(f'[collision-detector fn] Error calling release function ({response.status_code}): {response.text}')
     else:
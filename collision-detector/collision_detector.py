@@ -1,4 +1,8 @@
-from utility import haversine, predict_future_positions
+from itertools import combinations
+
+from utility import haversine
+from trajectory_batch import TrajectoryBatch
+from conflict_graph import flag_conflicts
 
 
 # Calculate the haversine distance between two points on the Earth's surface given their latitude and longitude.
@@ -33,32 +37,47 @@ def check_for_conflict(positions1, positions2, horizontal_separation, vertical_s
 
 
 # Main algorithm
-# Iterates over all aircraft pairs, and calls resolve_conflict if a conflict is detected.
-def detect_collisions(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation):
+# Iterates over all aircraft pairs (or the given candidate pairs), and collects every pair in conflict.
+def find_conflicts(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation, pairs=None,
+                   positions_cache=None):
     """
-    Detect potential conflicts between pairs of aircraft in the aircraft_list.
+    Find all pairs of aircraft in the aircraft_list that are in conflict within the prediction horizon.
     Args:
         aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
         time_interval: time interval between each step
         num_steps: number of steps to predict
         horizontal_separation: critical horizontal distance for conflict detection
         vertical_separation: critical vertical distance for conflict detection
+        pairs: optional (i, j) index pairs with i < j to check, e.g. from broad_phase.candidate_pairs.
+            All pairs are checked if None.
+        positions_cache: optional pair_cache.LRUCache of predicted positions per trajectory, kept across invocations
+
+    Returns:
+        list of (i, j, time_to_conflict), time_to_conflict being the time of the first step in conflict.
+    """
+    if pairs is None:
+        pairs = combinations(range(len(aircraft_list)), 2)
+    batch = TrajectoryBatch(aircraft_list, time_interval, num_steps, positions_cache)  # predict each aircraft once
+    conflicts = []
+    for i, j in pairs:
+        step = batch.first_conflict_step(i, j, horizontal_separation, vertical_separation)
+        if step is not None:
+            conflicts.append((i, j, step * time_interval))
+#           resolve_conflict(aircraft_list[i], aircraft_list[j])
+    return conflicts
+
+
+def detect_collisions(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation, pairs=None):
+    """
+    Detect potential conflicts between pairs of aircraft in the aircraft_list.
+    Args: see find_conflicts
 
     Returns:
         True if there is a conflict, False otherwise.
-        Modified aircraft_list with "collision": True key-value added to aircraft1 and aircraft2 where conflict is detected.
+        Modified aircraft_list with "collision": True and "time_to_conflict" key-values added to every aircraft in
+        conflict.
 
     """
-    collision = False
-    for i, aircraft1 in enumerate(aircraft_list):
-        positions1 = predict_future_positions(aircraft1, time_interval, num_steps)
-        for j, aircraft2 in enumerate(aircraft_list):
-            if i < j:
-                positions2 = predict_future_positions(aircraft2, time_interval, num_steps)
-                if check_for_conflict(positions1, positions2, horizontal_separation, vertical_separation):
-                    collision = True
-                    aircraft1["collision"] = True  # flag them, in-place
-                    aircraft2["collision"] = True
-                    break
-#                     resolve_conflict(aircraft1, aircraft2)
-    return collision, aircraft_list
+    conflicts = find_conflicts(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                               pairs)
+    return bool(conflicts), flag_conflicts(aircraft_list, conflicts)
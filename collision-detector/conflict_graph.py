@@ -0,0 +1,62 @@
+from math import inf
+
+
+def flag_conflicts(aircraft_list, conflicts):
+    """
+    Flag every aircraft that takes part in a conflict.
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        conflicts: list of (i, j, time_to_conflict) from one of the find_conflicts engines
+
+    Returns:
+        Modified aircraft_list with "collision": True and "time_to_conflict" (seconds to its earliest conflict)
+        key-values added to every aircraft in conflict (in-place).
+    """
+    for i, j, time_to_conflict in conflicts:
+        for aircraft in (aircraft_list[i], aircraft_list[j]):
+            aircraft["collision"] = True
+            aircraft["time_to_conflict"] = min(time_to_conflict, aircraft.get("time_to_conflict", inf))
+    return aircraft_list
+
+
+def as_context(aircraft):
+    # a copy for an aircraft that is sent along as context of another conflict: without the flags of flag_conflicts,
+    # and without the 'origin' of a mutation, which release publishes from the one call that carries the aircraft
+    return {key: value for key, value in aircraft.items() if key not in ("collision", "time_to_conflict", "origin")}
+
+
+def conflict_clusters(conflicts):
+    """
+    Group the conflicting aircraft into the connected components of the conflict graph. Aircraft in different
+    components do not affect each other, so each component can be resolved (mutated) independently.
+    Args:
+        conflicts: list of (i, j, time_to_conflict) from one of the find_conflicts engines
+
+    Returns:
+        list of (indices, time_to_conflict) per component, the indices sorted and the most urgent component first
+    """
+    parent = {}
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:  # path compression
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j, _ in conflicts:
+        parent.setdefault(i, i)
+        parent.setdefault(j, j)
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    members, urgency = {}, {}
+    for i in parent:
+        members.setdefault(find(i), []).append(i)
+    for i, _, time_to_conflict in conflicts:
+        root = find(i)
+        urgency[root] = min(time_to_conflict, urgency.get(root, inf))
+    return sorted(((sorted(indices), urgency[root]) for root, indices in members.items()),
+                  key=lambda cluster: (cluster[1], cluster[0][0]))
@@ -1,30 +1,82 @@
 #!/usr/bin/env python3
 
-import json
+import cold_start  # first, it marks when loading the function started
+import os
 import typing
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry import context
 
 from call_next_func import post_mutate, post_release
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
-from collision_detector import detect_collisions
-
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import metrics
+import wire_format
+from collision_detector import find_conflicts
+from vectorized_detector import find_conflicts_vectorized
+from cpa_detector import find_conflicts_cpa
+from enu_detector import find_conflicts_enu
+from broad_phase import candidate_pairs, delta_pairs, pair_neighbours, group_neighbours, reachable_neighbours
+from conflict_graph import flag_conflicts, conflict_clusters, as_context
+from parallel_detector import find_conflicts_parallel, warm_up as warm_up_pool
+from pair_cache import PairVerdictCache
+
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging()
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("collision-detector").tracer
 
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("collision-detector")
+INVOCATIONS = metrics.InvocationCounter()
+
 TIME_INTERVAL = 1; NUM_STEPS = 10; HORIZONTAL_SEPARATION = 1;  # https://trello.com/c/jVdQwhcZ/901-6gn-fix-collision-detection-detects-false-collisions
 VERTICAL_SEPARATION = 300  # TODO: get parameters from ENV
 
+# "scalar" (pure Python, default) or "vectorized" (NumPy, for large fleets) sample NUM_STEPS instants and return the
+# same result. "cpa" checks the continuous horizon analytically. "enu" projects the batch into a local metric frame
+# and moves the UAVs by their speed in meters, so the separations are actual distances
+DETECTION_ENGINES = {
+    "scalar": find_conflicts,
+    "vectorized": find_conflicts_vectorized,
+    "cpa": find_conflicts_cpa,
+    "enu": find_conflicts_enu,
+}
+DETECTION_ENGINE = os.environ.get("DETECTION_ENGINE", "scalar")
+if DETECTION_ENGINE not in DETECTION_ENGINES:
+    raise ValueError(f'Unknown DETECTION_ENGINE: {DETECTION_ENGINE}. Expected one of {list(DETECTION_ENGINES)}')
+# more than one worker shards the pair space over a warm process pool, if there are at least PARALLEL_MIN_PAIRS pairs
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", 1))
+PARALLEL_MIN_PAIRS = int(os.environ.get("PARALLEL_MIN_PAIRS", 200000))
+DETECTION_POOL_START_METHOD = os.environ.get("DETECTION_POOL_START_METHOD", "forkserver")  # the pool starts in warm_up
+# spatial grid broad phase: only pairs in the same or neighboring cells reach the detection engine
+BROAD_PHASE = os.environ.get("BROAD_PHASE", "true").lower() == "true"
+# verdicts of unchanged trajectory pairs (and predicted positions per trajectory) are kept across invocations.
+# 0 MB disables the cache
+PAIR_CACHE_MAX_MB = float(os.environ.get("PAIR_CACHE_MAX_MB", 32))
+POSITIONS_CACHE_MAX_MB = float(os.environ.get("POSITIONS_CACHE_MAX_MB", 16))
+PAIR_CACHE = None
+if PAIR_CACHE_MAX_MB > 0:
+    PAIR_CACHE = PairVerdictCache(int(PAIR_CACHE_MAX_MB * 2 ** 20), int(POSITIONS_CACHE_MAX_MB * 2 ** 20))
+
+# independent conflict clusters are sent to mutate in parallel
+MUTATE_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("MUTATE_FAN_OUT_WORKERS", 8)))
+# neighbours of a cluster sent along as context to mutate, the ones a mutation can reach the earliest first
+MUTATE_CONTEXT_MAX = int(os.environ.get("MUTATE_CONTEXT_MAX", 64))
+
+
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    chain_client.warm_up()
+    if DETECTION_WORKERS > 1:
+        warm_up_pool(DETECTION_WORKERS, DETECTION_POOL_START_METHOD)
+
 
 def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
     """
@@ -32,14 +84,21 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
     output:  calls the mutate function if the collision detected, otherwise based on 'origin' metadata,
         either calls the Release function or does nothing
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[collision-detector fn] invoke count: {str(Counter.get_count())}')
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[collision-detector fn] Parsed input: {parsed_input}')
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("collision-detector", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[collision-detector fn] invoke count: {invoke_count}')
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[collision-detector fn] Parsed input: %s', summarize(parsed_input))
 
             data = parsed_input.get('data', [])
             meta = parsed_input.get('meta', {})
@@ -51,11 +110,53 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
                 return 'No origin key found in meta'
 
         # Call collision detector function with the parsed input
-        with tracer.start_as_current_span('find_collisions') as collision_span:
-            collision_exists, flagged_data = detect_collisions(data, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
-                                                 VERTICAL_SEPARATION)
+        with tracer.start_as_current_span('find_collisions', attributes={"engine": DETECTION_ENGINE}) as collision_span, \
+                metrics.timed("detection", engine=DETECTION_ENGINE):
+            metrics.FLEET_SIZE.set(len(data))
+            pairs = None  # all pairs
+            if BROAD_PHASE:
+                with tracer.start_as_current_span('broad_phase') as broad_phase_span:
+                    pairs = candidate_pairs(data, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION, VERTICAL_SEPARATION)
+                    broad_phase_span.set_attribute("candidate_pairs", len(pairs))
+                    broad_phase_span.set_attribute("all_pairs", len(data) * (len(data) - 1) // 2)
+            broad_pairs = pairs  # before the delta, for the context of the clusters
+            # only check the UAVs that changed (self-report or mutation) against the rest, if the caller says which
+            changed_uav_ids = meta.get('changed_uav_ids')
+            collision_span.set_attribute("delta", changed_uav_ids is not None)
+            if changed_uav_ids is not None:
+                changed_pairs = delta_pairs(data, changed_uav_ids, pairs)
+                if changed_pairs is None:
+                    logger.warning(f'[collision-detector fn] changed uav_ids {changed_uav_ids} not in data, full scan')
+                else:
+                    pairs = changed_pairs
+                    collision_span.set_attribute("changed_uav_ids", [str(uav_id) for uav_id in changed_uav_ids])
+            collision_span.set_attribute("checked_pairs",
+                                         len(data) * (len(data) - 1) // 2 if pairs is None else len(pairs))
+            if PAIR_CACHE is None:
+                conflicts = run_detection_engine(data, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                                 VERTICAL_SEPARATION, pairs=pairs)
+            else:
+                hits, misses = PAIR_CACHE.verdicts.hits, PAIR_CACHE.verdicts.misses
+                positions_hits, positions_misses = PAIR_CACHE.positions.hits, PAIR_CACHE.positions.misses
+                conflicts = PAIR_CACHE.find_conflicts(run_detection_engine, data, TIME_INTERVAL, NUM_STEPS,
+                                                      HORIZONTAL_SEPARATION, VERTICAL_SEPARATION, pairs=pairs,
+                                                      engine_name=DETECTION_ENGINE)
+                collision_span.set_attribute("pair_cache_hits", PAIR_CACHE.verdicts.hits - hits)
+                collision_span.set_attribute("pair_cache_misses", PAIR_CACHE.verdicts.misses - misses)
+                collision_span.set_attribute("pair_cache_entries", len(PAIR_CACHE.verdicts))
+                collision_span.set_attribute("pair_cache_bytes", PAIR_CACHE.verdicts.size_bytes)
+                collision_span.set_attribute("positions_cache_hits", PAIR_CACHE.positions.hits - positions_hits)
+                collision_span.set_attribute("positions_cache_misses", PAIR_CACHE.positions.misses - positions_misses)
+                collision_span.set_attribute("positions_cache_bytes", PAIR_CACHE.positions.size_bytes)
+            collision_exists = bool(conflicts)
+            flag_conflicts(data, conflicts)  # in-place
+            clusters = conflict_clusters(conflicts)
             collision_span.set_attribute("collision", collision_exists)
-            logger.debug(f'[collision-detector fn] Result of collision detection: {collision_exists}')
+            collision_span.set_attribute("conflicts", len(conflicts))
+            collision_span.set_attribute("clusters", len(clusters))
+            metrics.COLLISIONS.add(len(conflicts))
+            logger.debug(f'[collision-detector fn] Result of collision detection: {collision_exists}, '
+                         f'{len(conflicts)} conflict(s) in {len(clusters)} cluster(s)')
 
         # Make a decision based on the collision detection result + origin metadata
         # TODO move to to a separate function file
@@ -74,39 +175,111 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
                         except Exception as e:
                             logger.error(f'[collision-detector  fn] Error in post_release: {e}')
                             post_release_span.set_attribute("error", True)
+                            metrics.record_error("post_release")
                             post_release_span.set_attribute("error_details", e)
 
                         return 'called release (safe and from system)'
                 else:
                     logger.error("origin is neither system nor self_report")
                     decision_span.set_attribute("error", True)
+                    metrics.record_error("final_decision")
                     decision_span.set_attribute("error_details", "origin is neither system nor self_report")
                     return 'origin is neither system nor self_report'
             elif collision_exists:
-                logger.info("calling mutate trajectories. (unsafe)")
-                with tracer.start_as_current_span('post_mutate') as post_mutate_span:
-                    try:
-                        r = post_mutate(flagged_data, meta, collision_exists)
-                        post_mutate_span.set_attribute("response_code", r.status_code)
-                    except Exception as e:
-                        logger.error(f'[collision-detector  fn] Error in post_mutate: {e}')
-                        post_mutate_span.set_attribute("error", True)
-                        post_mutate_span.set_attribute("error_details", e)
-                    return 'called mutate trajectories. (unsafe)'
-
-
-class Counter:
-    count = None
-
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
-
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+                logger.info(f"calling mutate trajectories for {len(clusters)} conflict cluster(s). (unsafe)")
+                # the clusters are mutated independently, each payload has the UAVs of one cluster
+                if broad_pairs is None:
+                    broad_pairs = candidate_pairs(data, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                                  VERTICAL_SEPARATION)
+                payloads = cluster_payloads(data, clusters, broad_pairs)
+                context_uavs = sum(context_count for _, context_count, _ in payloads)
+                context_left_out = sum(left_out for _, _, left_out in payloads)
+                decision_span.set_attribute("context_uavs", context_uavs)
+                decision_span.set_attribute("context_left_out", context_left_out)
+                if context_left_out:
+                    logger.warning(f'[collision-detector fn] {context_left_out} reachable neighbour(s) of the clusters '
+                                   f'left out of the context (MUTATE_CONTEXT_MAX={MUTATE_CONTEXT_MAX})')
+                parent_context = context.get_current()
+                futures = []
+                for index, ((indices, time_to_conflict), (cluster_data, _, _)) in enumerate(zip(clusters, payloads)):
+                    cluster_meta = dict(meta, cluster={"index": index, "count": len(clusters),
+                                                       "time_to_conflict": time_to_conflict})
+                    futures.append(MUTATE_POOL.submit(post_mutate_cluster, parent_context, cluster_data,
+                                                      cluster_meta))
+                for future in futures:
+                    future.result()
+                return f'called mutate trajectories for {len(clusters)} conflict cluster(s). (unsafe)'
+
+
+def run_detection_engine(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                         pairs=None):
+    # the configured engine, sharded over the process pool for large pair sets
+    checked_pairs = len(aircraft_list) * (len(aircraft_list) - 1) // 2 if pairs is None else len(pairs)
+    if DETECTION_WORKERS > 1 and checked_pairs >= PARALLEL_MIN_PAIRS:
+        return find_conflicts_parallel(aircraft_list, time_interval, num_steps, horizontal_separation,
+                                       vertical_separation, pairs=pairs, engine=DETECTION_ENGINE,
+                                       workers=DETECTION_WORKERS, start_method=DETECTION_POOL_START_METHOD)
+    engine_kwargs = {}
+    if PAIR_CACHE is not None and DETECTION_ENGINE == "scalar":
+        engine_kwargs["positions_cache"] = PAIR_CACHE.positions
+    return DETECTION_ENGINES[DETECTION_ENGINE](aircraft_list, time_interval, num_steps, horizontal_separation,
+                                               vertical_separation, pairs=pairs, **engine_kwargs)
+
+
+def cluster_payloads(data, clusters, broad_pairs):
+    """
+    The payload of each conflict cluster for mutate: the UAVs of the cluster, the mutated UAVs that go along with it,
+    and its context.
+    A UAV mutated earlier in the chain that is in no cluster any more goes along with one cluster only (the first one
+    it is a neighbour of, else the most urgent one), with its 'origin', so release publishes its mutation once.
+    The context are the broad-phase neighbours a mutation of the cluster can reach (see reachable_neighbours), at most
+    MUTATE_CONTEXT_MAX of them, without the flags and the 'origin' (see as_context). They are there so the re-check
+    after the mutation covers them as well, the ones left out are only checked again when they report.
+    Args:
+        data: the flagged trajectories
+        clusters: list of (indices, time_to_conflict) from conflict_clusters
+        broad_pairs: the candidate_pairs of data
+
+    Returns:
+        list of (payload, context count, reachable neighbours left out of the context) per cluster
+    """
+    neighbours = pair_neighbours(broad_pairs)
+    cluster_sets = [set(indices) for indices, _ in clusters]
+    in_clusters = set().union(*cluster_sets)
+    carried_by = {}
+    for i, aircraft in enumerate(data):
+        if aircraft.get('origin') == 'mutate' and i not in in_clusters:
+            carried_by[i] = next((index for index, members in enumerate(cluster_sets)
+                                  if neighbours.get(i, set()) & members), 0)
+
+    payloads = []
+    for index, (indices, _) in enumerate(clusters):
+        carried = sorted(i for i, carrier in carried_by.items() if carrier == index)
+        candidates = [i for i in group_neighbours(neighbours, indices) if carried_by.get(i) != index]
+        reachable = reachable_neighbours(data, indices, candidates, TIME_INTERVAL, NUM_STEPS, HORIZONTAL_SEPARATION,
+                                         VERTICAL_SEPARATION)
+        kept = reachable[:MUTATE_CONTEXT_MAX]
+        payload = [data[i] for i in indices] + [data[i] for i in carried] + [as_context(data[i]) for i in kept]
+        payloads.append((payload, len(kept), len(reachable) - len(kept)))
+    return payloads
+
+
+def post_mutate_cluster(parent_context, cluster_data, cluster_meta):
+    # runs on MUTATE_POOL, so the span is attached to the fn span explicitly
+    token = context.attach(parent_context)
+    try:
+        with tracer.start_as_current_span('post_mutate', attributes={"cluster": cluster_meta['cluster']['index'],
+                                                                     "cluster_size": len(cluster_data)}) as post_mutate_span:
+            try:
+                r = post_mutate(cluster_data, cluster_meta, True)
+                post_mutate_span.set_attribute("response_code", r.status_code)
+            except Exception as e:
+                logger.error(f'[collision-detector  fn] Error in post_mutate: {e}')
+                post_mutate_span.set_attribute("error", True)
+                metrics.record_error("post_mutate")
+                post_mutate_span.set_attribute("error_details", e)
+    finally:
+        context.detach(token)
+
+
+cold_start.loaded("collision-detector", warm_up)
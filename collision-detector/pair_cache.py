@@ -0,0 +1,118 @@
+import sys
+from collections import OrderedDict
+from itertools import combinations
+
+ENTRY_OVERHEAD = 100  # bytes per entry for the OrderedDict node and its hash slot, on top of key and value
+MOTION_KEYS = ("latitude", "longitude", "altitude", "speed", "direction", "vertical_speed")
+
+
+class LRUCache:
+    """
+    Least recently used cache with a hard cap on the bytes of its entries. The size of an entry is the estimate given
+    by the caller, or sys.getsizeof of its key and value, plus ENTRY_OVERHEAD for the cache's own bookkeeping.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def put(self, key, value, size=None):
+        # size: the caller's own (deeper) estimate of the entry's bytes, instead of the shallow default
+        if size is None:
+            size = sys.getsizeof(key) + sys.getsizeof(value)
+        size += ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size_bytes -= old[1]
+        self._entries[key] = (value, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+
+def trajectory_key(aircraft):
+    # the Mongo _id identifies a stored report, the motion values catch trajectories that mutate changed in place
+    return (aircraft.get("_id", aircraft.get("uav_id")),) + tuple(aircraft[key] for key in MOTION_KEYS)
+
+
+def deep_size(key):
+    # bytes of a tuple and its elements, the keys are shared between entries but counted for each to keep a hard cap
+    return sys.getsizeof(key) + sum(sys.getsizeof(element) for element in key)
+
+
+class PairVerdictCache:
+    """
+    Conflict verdicts of trajectory pairs, kept across invocations of the function instance, so that pairs of
+    unchanged trajectories are not checked again. Also holds the predicted positions per trajectory (see
+    TrajectoryBatch) in a second cache.
+    """
+
+    def __init__(self, max_bytes, positions_max_bytes):
+        self.verdicts = LRUCache(max_bytes)  # (frozenset of two trajectory keys, params) -> time_to_conflict or None
+        self.positions = LRUCache(positions_max_bytes)  # (trajectory key, time_interval, num_steps) -> positions
+
+    def find_conflicts(self, engine, aircraft_list, time_interval, num_steps, horizontal_separation,
+                       vertical_separation, pairs=None, engine_name=None, **engine_kwargs):
+        """
+        Same as the find_conflicts engines, only the pairs without a cached verdict are passed on to the engine.
+        Args:
+            engine: one of the find_conflicts engines (or a function with the same signature)
+            engine_name: part of the cache key, so the verdicts of different engines are not mixed. engine.__name__
+                if None
+            engine_kwargs: passed on to the engine
+
+        Returns:
+            list of (i, j, time_to_conflict), sorted by (i, j).
+        """
+        if pairs is None:
+            pairs = combinations(range(len(aircraft_list)), 2)
+        params = (engine_name or engine.__name__, time_interval, num_steps, horizontal_separation, vertical_separation)
+        keys = [trajectory_key(aircraft) for aircraft in aircraft_list]
+        key_sizes = [deep_size(key) for key in keys]
+        pair_key_size = sys.getsizeof((None, None)) + sys.getsizeof(frozenset((None, 0)))
+
+        conflicts, missed_pairs, missed_keys = [], [], []
+        for i, j in pairs:
+            key = (frozenset((keys[i], keys[j])), params)
+            time_to_conflict = self.verdicts.get(key, self)  # self as the "not cached" marker, None is a verdict
+            if time_to_conflict is self:
+                missed_pairs.append((i, j))
+                missed_keys.append((key, pair_key_size + key_sizes[i] + key_sizes[j]))
+            elif time_to_conflict is not None:
+                conflicts.append((i, j, time_to_conflict))
+
+        if missed_pairs:
+            found = {(i, j): time_to_conflict for i, j, time_to_conflict in
+                     engine(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                            pairs=missed_pairs, **engine_kwargs)}
+            for pair, (key, key_size) in zip(missed_pairs, missed_keys):
+                time_to_conflict = found.get(pair)
+                self.verdicts.put(key, time_to_conflict, key_size + sys.getsizeof(time_to_conflict))
+            conflicts.extend((i, j, time_to_conflict) for (i, j), time_to_conflict in found.items())
+            conflicts.sort(key=lambda conflict: (conflict[0], conflict[1]))
+        return conflicts
@@ -0,0 +1,127 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from collision_detector import find_conflicts
+from vectorized_detector import find_conflicts_vectorized
+from cpa_detector import find_conflicts_cpa
+from enu_detector import find_conflicts_enu
+
+ENGINES = {
+    "scalar": find_conflicts,
+    "vectorized": find_conflicts_vectorized,
+    "cpa": find_conflicts_cpa,
+    "enu": find_conflicts_enu,
+}
+SHARDS_PER_WORKER = 4  # more shards than workers, so a slow shard does not hold up the merge
+MAX_PAIRS_PER_CALL = 2 ** 18  # bounds the pair array the vectorized engine builds for a row block at once
+# the engines only read these keys, the rest of each trajectory is not sent to the workers
+MOTION_KEYS = ("latitude", "longitude", "altitude", "speed", "direction", "vertical_speed")
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()  # the warm-up thread and the first invocations may ask for the pool at the same time
+
+
+def get_pool(workers, start_method="forkserver"):
+    """
+    The process pool is kept for the lifetime of the function instance, so the workers stay warm across invocations.
+    forkserver (or spawn) is used by default, as forking a process with running gRPC exporter threads is not safe.
+    """
+    global _pool, _pool_workers
+    pool = _pool
+    if pool is not None and _pool_workers == workers:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+            _pool_workers = workers
+        return _pool
+
+
+def _noop():
+    return None
+
+
+def warm_up(workers, start_method="forkserver"):
+    # start all worker processes (and import the engines in them) before the first real invocation
+    pool = get_pool(workers, start_method)
+    for future in [pool.submit(_noop) for _ in range(workers)]:
+        future.result()
+
+
+def _row_pairs(n, row_start, row_end):
+    return ((i, j) for i in range(row_start, row_end) for j in range(i + 1, n))
+
+
+def _find_conflicts_shard(engine, aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                          row_start=None, row_end=None, pairs=None):
+    # runs in a worker process: a block of rows of the pair space, or a chunk of the candidate pairs
+    if pairs is None:
+        pairs = _row_pairs(len(aircraft_list), row_start, row_end)
+    if engine != "vectorized":  # the pure Python engines consume the pairs lazily
+        return ENGINES[engine](aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                               pairs=pairs)
+    pairs = iter(pairs)
+    conflicts = []
+    while True:
+        chunk = list(islice(pairs, MAX_PAIRS_PER_CALL))
+        if not chunk:
+            return conflicts
+        conflicts.extend(ENGINES[engine](aircraft_list, time_interval, num_steps, horizontal_separation,
+                                         vertical_separation, pairs=chunk))
+
+
+def _row_blocks(n, shards):
+    # splits rows 0..n-1 into blocks with about the same number of (i, j > i) pairs each
+    total = n * (n - 1) // 2
+    blocks, row_start, pairs_in_block = [], 0, 0
+    for i in range(n):
+        pairs_in_block += n - 1 - i
+        if pairs_in_block >= total / shards or i == n - 1:
+            blocks.append((row_start, i + 1))
+            row_start, pairs_in_block = i + 1, 0
+    return blocks
+
+
+def find_conflicts_parallel(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                            pairs=None, engine="scalar", workers=2, start_method="forkserver"):
+    """
+    Sharded version of the find_conflicts engines: the pair space is split into row blocks (or the candidate pairs
+    into chunks) that are checked on a warm process pool, and the results are merged.
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        time_interval: time interval between each step
+        num_steps: number of steps to predict
+        horizontal_separation: critical horizontal distance for conflict detection
+        vertical_separation: critical vertical distance for conflict detection
+        pairs: optional sorted (i, j) index pairs with i < j to check, e.g. from broad_phase.candidate_pairs.
+            All pairs are checked if None.
+        engine: name of the engine the workers run, one of ENGINES
+        workers: number of worker processes
+        start_method: multiprocessing start method of the pool
+
+    Returns:
+        Same as find_conflicts: list of (i, j, time_to_conflict), sorted by (i, j).
+    """
+    pool = get_pool(workers, start_method)
+    shards = workers * SHARDS_PER_WORKER
+    motions = [{key: aircraft[key] for key in MOTION_KEYS} for aircraft in aircraft_list]
+    args = (engine, motions, time_interval, num_steps, horizontal_separation, vertical_separation)
+    if pairs is None:
+        futures = [pool.submit(_find_conflicts_shard, *args, row_start=row_start, row_end=row_end)
+                   for row_start, row_end in _row_blocks(len(aircraft_list), shards)]
+    else:
+        pairs = list(pairs)
+        chunk_size = max(1, -(-len(pairs) // shards))
+        futures = [pool.submit(_find_conflicts_shard, *args, pairs=pairs[start:start + chunk_size])
+                   for start in range(0, len(pairs), chunk_size)]
+
+    conflicts = []
+    for future in futures:
+        conflicts.extend(future.result())
+    conflicts.sort(key=lambda conflict: (conflict[0], conflict[1]))
+    return conflicts
@@ -0,0 +1,85 @@
+from array import array
+from math import radians, cos, sin
+
+from utility import haversine
+from pair_cache import trajectory_key, deep_size
+
+
+class TrajectoryBatch:
+    """
+    Future positions of a whole aircraft_list, predicted once per aircraft (same model as
+    utility.predict_future_positions) and stored as flat float arrays instead of a list of dicts per aircraft.
+    The positions of aircraft i are at indices [i * num_steps, (i + 1) * num_steps).
+    With a positions_cache (pair_cache.LRUCache), the positions of trajectories seen in earlier invocations are reused.
+    """
+    __slots__ = ("count", "time_interval", "num_steps", "latitudes", "longitudes", "altitudes")
+
+    def __init__(self, aircraft_list, time_interval, num_steps, positions_cache=None):
+        self.count = len(aircraft_list)
+        self.time_interval = time_interval
+        self.num_steps = num_steps
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.altitudes = array("d")
+
+        future_times = [step * time_interval for step in range(num_steps)]
+        for aircraft in aircraft_list:
+            if positions_cache is not None:
+                key = (trajectory_key(aircraft), time_interval, num_steps)
+                positions = positions_cache.get(key)
+                if positions is not None:
+                    self.latitudes.extend(positions[0])
+                    self.longitudes.extend(positions[1])
+                    self.altitudes.extend(positions[2])
+                    continue
+            speed_kms = aircraft["speed"] / 3600  # Convert speed from km/h to km/s
+            heading = radians(90 - aircraft["direction"])
+            lat_factor, lon_factor = sin(heading), cos(heading)
+            latitude, longitude = aircraft["latitude"], aircraft["longitude"]
+            altitude, vertical_speed = aircraft["altitude"], aircraft["vertical_speed"]
+            positions = (array("d", (latitude + speed_kms * t * lat_factor for t in future_times)),
+                         array("d", (longitude + speed_kms * t * lon_factor for t in future_times)),
+                         array("d", (altitude + vertical_speed * t for t in future_times)))
+            self.latitudes.extend(positions[0])
+            self.longitudes.extend(positions[1])
+            self.altitudes.extend(positions[2])
+            if positions_cache is not None:
+                positions_cache.put(key, positions, deep_size(key[0]) + deep_size(positions))
+
+    def __len__(self):
+        return self.count
+
+    def positions(self, i):
+        """
+        Returns:
+            future positions of aircraft i in the list-of-dicts format of utility.predict_future_positions
+        """
+        start, end = i * self.num_steps, (i + 1) * self.num_steps
+        return [{"latitude": latitude, "longitude": longitude, "altitude": altitude}
+                for latitude, longitude, altitude in zip(self.latitudes[start:end], self.longitudes[start:end],
+                                                         self.altitudes[start:end])]
+
+    def first_conflict_step(self, i, j, horizontal_separation, vertical_separation):
+        """
+        Same check as collision_detector.check_for_conflict for aircraft i and j of the batch, without building dicts.
+        The cheap vertical check goes first so haversine only runs for vertically close steps.
+        Returns:
+            the first step at which aircraft i and j are in conflict, None if they are not
+        """
+        latitudes, longitudes, altitudes = self.latitudes, self.longitudes, self.altitudes
+        start = i * self.num_steps
+        offset = (j - i) * self.num_steps
+        for step1 in range(start, start + self.num_steps):
+            step2 = step1 + offset
+            if (abs(altitudes[step1] - altitudes[step2]) < vertical_separation and
+                    haversine(latitudes[step1], longitudes[step1], latitudes[step2],
+                              longitudes[step2]) < horizontal_separation):
+                return step1 - start
+        return None
+
+    def check_for_conflict(self, i, j, horizontal_separation, vertical_separation):
+        """
+        Returns:
+            Boolean: True if conflict is detected between aircraft i and j, False otherwise.
+        """
+        return self.first_conflict_step(i, j, horizontal_separation, vertical_separation) is not None
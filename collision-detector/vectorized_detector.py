@@ -0,0 +1,148 @@
+from conflict_graph import flag_conflicts
+
+R = 6371.0  # Radius of the Earth in kilometers, same as utility.haversine
+MAX_BLOCK_ELEMENTS = 2 ** 22  # upper bound for the (rows, n, num_steps) intermediates, ~32MB per float64 array
+
+
+def predict_future_positions_vectorized(aircraft_list, time_interval, num_steps):
+    """
+    Array version of utility.predict_future_positions for the whole aircraft_list at once.
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        time_interval: time interval between each step
+        num_steps: number of steps to predict
+
+    Returns:
+        latitudes, longitudes, altitudes: three (len(aircraft_list), num_steps) arrays of future positions
+
+    """
+    import numpy as np  # only needed by the vectorized engine
+
+    latitude = np.fromiter((a["latitude"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+    longitude = np.fromiter((a["longitude"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+    altitude = np.fromiter((a["altitude"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+    speed = np.fromiter((a["speed"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+    direction = np.fromiter((a["direction"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+    vertical_speed = np.fromiter((a["vertical_speed"] for a in aircraft_list), dtype=float, count=len(aircraft_list))
+
+    future_time = np.arange(num_steps) * time_interval  # (num_steps,)
+    distance = (speed / 3600)[:, None] * future_time  # km covered per aircraft per step, (n, num_steps)
+    heading = np.radians(90 - direction)[:, None]
+    latitudes = latitude[:, None] + distance * np.sin(heading)
+    longitudes = longitude[:, None] + distance * np.cos(heading)
+    altitudes = altitude[:, None] + vertical_speed[:, None] * future_time
+    return latitudes, longitudes, altitudes
+
+
+def find_conflicting_pairs(latitudes, longitudes, altitudes, horizontal_separation, vertical_separation,
+                           block_size=None, pairs=None):
+    """
+    Broadcast check_for_conflict over all aircraft pairs and all time steps, a block of rows at a time so the
+    intermediate (rows, n, num_steps) arrays stay bounded for large fleets.
+    Args:
+        latitudes, longitudes, altitudes: (n, num_steps) arrays of future positions
+        horizontal_separation: critical horizontal distance for conflict detection
+        vertical_separation: critical vertical distance for conflict detection
+        block_size: number of rows per block, derived from MAX_BLOCK_ELEMENTS if None
+        pairs: optional sorted (i, j) index pairs with i < j to check instead of all pairs
+
+    Returns:
+        rows, cols, steps: index arrays of the conflicting pairs (rows < cols) in row-major order, and of the first
+        step each pair is in conflict.
+    """
+    import numpy as np
+
+    n, num_steps = latitudes.shape
+    lat_rad = np.radians(latitudes)
+    lon_rad = np.radians(longitudes)
+    cos_lat = np.cos(lat_rad)
+
+    if pairs is not None:
+        return _find_conflicting_candidate_pairs(lat_rad, lon_rad, cos_lat, altitudes, horizontal_separation,
+                                                 vertical_separation, pairs)
+
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(1, n * num_steps))
+
+    rows, cols, steps = [], [], []
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        # haversine against the columns from start on, (block, n - start, num_steps)
+        dlat = lat_rad[None, start:] - lat_rad[start:end, None]
+        dlon = lon_rad[None, start:] - lon_rad[start:end, None]
+        a = np.sin(dlat / 2) ** 2 + cos_lat[start:end, None] * cos_lat[None, start:] * np.sin(dlon / 2) ** 2
+        horizontal_distance = R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        vertical_distance = np.abs(altitudes[None, start:] - altitudes[start:end, None])
+
+        violation = (horizontal_distance < horizontal_separation) & (vertical_distance < vertical_separation)
+        in_conflict = violation.any(axis=2)
+        in_conflict &= np.arange(start, n)[None, :] > np.arange(start, end)[:, None]  # upper triangle only (i < j)
+        block_rows, block_cols = in_conflict.nonzero()
+        rows.append(block_rows + start)
+        cols.append(block_cols + start)
+        steps.append(violation[block_rows, block_cols].argmax(axis=1))
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(steps)
+
+
+def _find_conflicting_candidate_pairs(lat_rad, lon_rad, cos_lat, altitudes, horizontal_separation,
+                                     vertical_separation, pairs):
+    import numpy as np
+
+    num_steps = lat_rad.shape[1]
+    candidates = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+    chunk_size = max(1, MAX_BLOCK_ELEMENTS // max(1, num_steps))
+    rows, cols, steps = [], [], []
+    for start in range(0, len(candidates), chunk_size):
+        i, j = candidates[start:start + chunk_size].T
+        # haversine, (chunk, num_steps)
+        dlat = lat_rad[j] - lat_rad[i]
+        dlon = lon_rad[j] - lon_rad[i]
+        a = np.sin(dlat / 2) ** 2 + cos_lat[i] * cos_lat[j] * np.sin(dlon / 2) ** 2
+        horizontal_distance = R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        vertical_distance = np.abs(altitudes[j] - altitudes[i])
+
+        violation = (horizontal_distance < horizontal_separation) & (vertical_distance < vertical_separation)
+        in_conflict = violation.any(axis=1)
+        rows.append(i[in_conflict])
+        cols.append(j[in_conflict])
+        steps.append(violation[in_conflict].argmax(axis=1))
+    if not rows:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(steps)
+
+
+def find_conflicts_vectorized(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                              pairs=None):
+    """
+    NumPy engine for collision_detector.find_conflicts. Predicts all aircraft once and checks all pairs and all
+    time steps in a single broadcast instead of a Python loop per pair and per step.
+    Args:
+        aircraft_list: list of dictionaries containing the current position and motion parameters of the aircraft
+        time_interval: time interval between each step
+        num_steps: number of steps to predict
+        horizontal_separation: critical horizontal distance for conflict detection
+        vertical_separation: critical vertical distance for conflict detection
+        pairs: optional sorted (i, j) index pairs with i < j to check, e.g. from broad_phase.candidate_pairs.
+            All pairs are checked if None.
+
+    Returns:
+        Same as find_conflicts: list of (i, j, time_to_conflict), time_to_conflict being the time of the first step
+        in conflict.
+    """
+    if len(aircraft_list) < 2:
+        return []
+
+    latitudes, longitudes, altitudes = predict_future_positions_vectorized(aircraft_list, time_interval, num_steps)
+    rows, cols, steps = find_conflicting_pairs(latitudes, longitudes, altitudes, horizontal_separation,
+                                               vertical_separation, pairs=pairs)
+    return [(i, j, step * time_interval) for i, j, step in zip(rows.tolist(), cols.tolist(), steps.tolist())]
+
+
+def detect_collisions_vectorized(aircraft_list, time_interval, num_steps, horizontal_separation, vertical_separation,
+                                 pairs=None):
+    """
+    Same as collision_detector.detect_collisions, using the NumPy engine.
+    """
+    conflicts = find_conflicts_vectorized(aircraft_list, time_interval, num_steps, horizontal_separation,
+                                          vertical_separation, pairs)
+    return bool(conflicts), flag_conflicts(aircraft_list, conflicts)
@@ -1,8 +1,8 @@
-import requests
 import logging
 
-host = "172.17.0.1"
-# host = "host.docker.internal"
+import chain_client
+import wire_format
+from log_setup import summarize
 
 # Set up Python logger
 # logging.basicConfig(level=logging.DEBUG)
@@ -10,17 +10,17 @@ logger = logging.getLogger(__name__)
 
 
 def post_collision_detector(data, meta):
-    url = f"http://{host}:8000/collisiondetector"
+    url = chain_client.function_url("collisiondetector")
     headers = {
-        "Content-Type": "application/json",
-        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response
+        "X-tinyFaaS-Async": "true"}  # tinyfaas will return a 202 response. Content-Type is set by wire_format
 
     payload = {
         "data": data,
         "meta": meta
     }
-    logger.debug(f'[mutate fn] calling collisiondetector function on {url} with payload: {payload}')
-    response = requests.post(url, headers=headers, json=payload)
+    logger.debug('[mutate fn] calling collisiondetector function on %s with payload: %s', url, summarize(payload))
+    body, headers["Content-Type"] = wire_format.encode(payload)
+    response = chain_client.post("collisiondetector", headers=headers, data=body)
     if response.status_code != 202:  # async call
         logger.error(f'[mutate fn] Error calling collisiondetector function ({response.status_code}): {response.text}')
     else:
@@ -0,0 +1,66 @@
+import logging
+import os
+import threading
+import time
+
+# NOTE: the same module is in every function, keep them in sync
+
+# imported first by fn, so this is about when the instance started loading the function
+IMPORT_STARTED = time.perf_counter()
+
+# How fn's warm_up (opening the Mongo/MQTT/HTTP connections) runs when the function is loaded: 'background' (default,
+# in a thread, so loading is not held up by the network), 'import' (before loading finishes) or 'off' (the connections
+# are opened by the first invocations). A request with the WARM_UP_HEADER runs it as well, and does nothing else
+WARM_UP = os.environ.get("WARM_UP", "background")
+if WARM_UP not in ("background", "import", "off"):
+    raise ValueError(f'Unknown WARM_UP: {WARM_UP}. Expected one of {["background", "import", "off"]}')
+WARM_UP_HEADER = "x-warm-up"
+
+# Set up Python logger
+logger = logging.getLogger(__name__)
+
+_first_invocation = threading.Lock()
+_cold = True
+
+
+def loaded(name, warm_up):
+    """
+    Called by fn at the end of its import: logs the import time and starts the warm-up as set by WARM_UP.
+    Args:
+        name: of the function, for the logs
+        warm_up: function opening the connections of the function
+    """
+    logger.info(f'[{name} fn] imported in {(time.perf_counter() - IMPORT_STARTED) * 1000:.1f} ms')
+    if WARM_UP == "import":
+        run_warm_up(name, warm_up)
+    elif WARM_UP == "background":
+        threading.Thread(target=run_warm_up, args=(name, warm_up), name='warm-up', daemon=True).start()
+
+
+def run_warm_up(name, warm_up):
+    start = time.perf_counter()
+    try:
+        warm_up()
+        logger.info(f'[{name} fn] warmed up in {(time.perf_counter() - start) * 1000:.1f} ms')
+    except Exception as e:  # what is not open yet is opened by the invocations
+        logger.warning(f'[{name} fn] warm-up failed after {(time.perf_counter() - start) * 1000:.1f} ms: {e}')
+
+
+def is_warm_up_request(headers):
+    return any(key.lower() == WARM_UP_HEADER for key in (headers or {}))
+
+
+def record_cold_start(span):
+    """
+    Sets cold_start_ms (from loading the function to the start of this invocation) on the span of the first invocation
+    of the instance, so the time to the first response is cold_start_ms plus the duration of that span.
+    """
+    global _cold
+    if not _cold:
+        return
+    with _first_invocation:
+        if not _cold:
+            return
+        _cold = False
+    span.set_attribute("cold_start", True)
+    span.set_attribute("cold_start_ms", (time.perf_counter() - IMPORT_STARTED) * 1000)
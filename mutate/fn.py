@@ -1,27 +1,29 @@
 #!/usr/bin/env python3
 
+import cold_start  # first, it marks when loading the function started
 import json
 import typing
 import logging
 
 from call_next_func import post_collision_detector
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import metrics
+import wire_format
 from mutate import dec_speed_of_lower_collider, change_dir_of_lower_collider
 
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.INFO,  ###################################
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging("INFO")
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("mutate").tracer
 
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("mutate")
+INVOCATIONS = metrics.InvocationCounter()
+
 # Load abilities from JSON file
 with open('abilities.json', 'r') as f:
     abilities = json.load(f)
@@ -30,24 +32,40 @@ logger.debug(f'[mutate fn] Abilities: {abilities}')
 MAX_MUTATIONS = 100  # TODO: get from ENV
 
 
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    chain_client.warm_up()
+
+
 # FIXME: the output's 'direction' and 'speed' values can be long floats. make them int afterward?
 def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
     """
     input: A JSON string that represents a dictionary with a trajectory set 'data' and 'meta' keys.
     output: calls the magic selector function with a collection of mutated trajectories set (candidates)
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[mutate fn] invoke count: {str(Counter.get_count())}')
-
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[mutate fn] Parsed input: {parsed_input}')
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("mutate", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[mutate fn] invoke count: {invoke_count}')
+
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[mutate fn] Parsed input: %s', summarize(parsed_input))
 
             data = parsed_input.get('data', [])
             meta = parsed_input.get('meta', {})
+            # the mutation clears the flags, and may leave other conflicts of the cluster to the next round
+            flagged_uav_ids = [t['uav_id'] for t in data if t.get('collision', False)]
 
         # TODO: merge MAX_MUTATIONS check with "mutation cases"?
         # (check &) increment the number of mutations (guard clauses)
@@ -67,11 +85,12 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
             else:
                 msg = f"[mutate fn] fatal! unexpected origin or mutations value. origin: {meta['origin']}"
                 process_mutate_count_span.set_attribute("error", True)
+                metrics.record_error("process_mutate_count")
                 logger.fatal(msg)
                 return msg  # guard clause
 
         # apply mutation cases
-        with tracer.start_as_current_span('mutation') as mutation_cases_span:
+        with tracer.start_as_current_span('mutation') as mutation_cases_span, metrics.timed("mutation"):
             mutation_cases_str = meta.get('mutation_cases', '000')  # replace with bin 000 if None
             logger.info(f"[mutate fn] mutation_cases: {mutation_cases_str}")
             mutation_cases = int(mutation_cases_str, 2)  # parse as binary
@@ -81,19 +100,23 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
                     success, mutated_trajectory_set = dec_speed_of_lower_collider(data, abilities)  # Case 1
                     if not success:
                         case1_span.set_attribute("error", True)
+                        metrics.record_error("case1_mutation")
                         case1_span.set_attribute("error_details", mutated_trajectory_set)
                         return json.dumps(
                             {"error": mutated_trajectory_set})  # mutated_trajectory_set is just a string message here
                     updated_mutation_cases = mutation_cases | 0b001  # set the first bit to 1
+                    metrics.MUTATIONS.add(1)  # a case mutates one trajectory, the lowest priority collider
             elif mutation_cases == 0b001:  # mutation_cases & 0b011 == 1
                 with tracer.start_as_current_span('case2_mutation') as case2_span:
                     success, mutated_trajectory_set = change_dir_of_lower_collider(data, abilities)
                     if not success:
                         case2_span.set_attribute("error", True)
+                        metrics.record_error("case2_mutation")
                         case2_span.set_attribute("error_details", mutated_trajectory_set)
                         return json.dumps(
                             {"error": mutated_trajectory_set})  # mutated_trajectory_set is just a string message here
                     updated_mutation_cases = mutation_cases | 0b010  # set the second bit to 1
+                    metrics.MUTATIONS.add(1)
             else:
                 # TODO: Add case 3 mutations here
                 logger.error(f"[mutate fn] mutation_cases: {mutation_cases_str} - not implemented")
@@ -104,29 +127,19 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
         with tracer.start_as_current_span('post_collision_detector') as post_collision_detector_span:
             meta['origin'] = "system"  # change origin of the data if it is 'self_report'
             meta['mutation_cases'] = f'{updated_mutation_cases:03b}'  # convert back to binary string
+            # the detector only re-checks the flagged UAVs of the cluster (including the mutated one) against the rest,
+            # so the conflicts among them that were not resolved in this round are found again
+            meta['changed_uav_ids'] = flagged_uav_ids
             try:
                 r = post_collision_detector(mutated_trajectory_set, meta)
                 post_collision_detector_span.set_attribute("response_code", r.status_code)
             except Exception as e:
                 logger.error(f'[mutate fn] Error in post_collision_detector: {e}')
                 post_collision_detector_span.set_attribute("error", True)
+                metrics.record_error("post_collision_detector")
                 post_collision_detector_span.set_attribute("error_details", e)
 
         return str({"data": mutated_trajectory_set})
 
 
-class Counter:
-    count = None
-
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
-
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+cold_start.loaded("mutate", warm_up)
@@ -1,21 +1,40 @@
 import logging
 import random
 
+from log_setup import summarize
+
 logger = logging.getLogger(__name__)
 
 
+# narrows the colliders down to the most urgent conflict, by the time to conflict flag_conflicts sets (any engine)
+def most_urgent_colliders(collision_trajectories):
+    times_to_conflict = [t['time_to_conflict'] for t in collision_trajectories if 'time_to_conflict' in t]
+    if not times_to_conflict:
+        return collision_trajectories
+    most_urgent = min(times_to_conflict)
+    return [t for t in collision_trajectories if t.get('time_to_conflict') == most_urgent]
+
+
+# removes the detector's flags from the trajectories
+def clear_collision_flags(collision_trajectories):
+    for trajectory in collision_trajectories:
+        trajectory.pop('collision', None)
+        trajectory.pop('time_to_conflict', None)
+
+
 # decreases the speed of the lower priority UAV with a collision (from two colliding UAVs)
 def dec_speed_of_lower_collider(trajectories, abilities):
     # Filter trajectories with collision set to True
     collision_trajectories = [t for t in trajectories if t.get('collision', False)]
 
     if len(collision_trajectories) <= 1:
-        logger.error(
-            f'[mutate fn] (case1) Not enough collisions to determine lower priority UAV: {collision_trajectories}')
-        return False, f'(case1) Not enough collisions to determine lower priority UAV: {collision_trajectories}'
+        logger.error('[mutate fn] (case1) Not enough collisions to determine lower priority UAV: %s',
+                     summarize(collision_trajectories))
+        return False, f'(case1) Not enough collisions to determine lower priority UAV: {summarize(collision_trajectories)}'
 
-    # Find the trajectory with the highest uav_id (Lower priority)
-    lowest_uav_id_trajectory = max(collision_trajectories, key=lambda t: t['uav_id'])  #TODO proper priority check
+    # Find the trajectory with the highest uav_id (Lower priority) of the most urgent conflict
+    lowest_uav_id_trajectory = max(most_urgent_colliders(collision_trajectories),
+                                   key=lambda t: t['uav_id'])  #TODO proper priority check
 
     # Decrease the speed by 25% (inplace)
     original_speed = lowest_uav_id_trajectory['speed']
@@ -25,10 +44,8 @@ def dec_speed_of_lower_collider(trajectories, abilities):
     lowest_uav_id_trajectory['origin'] = 'mutate'  # flag the updated trajectory
     lowest_uav_id_trajectory['mutation_cases'] = f"{int(lowest_uav_id_trajectory.get('mutation_cases', '000'), 2) | 0b001:03b}"  # binary flag for Case 1. supposed to be null
 
-    # Remove the "collision" key from each trajectory in collision_trajectories
-    for trajectory in collision_trajectories:
-        if 'collision' in trajectory:
-            del trajectory['collision']
+    # Remove the "collision" and "time_to_conflict" keys from each trajectory in collision_trajectories
+    clear_collision_flags(collision_trajectories)
 
     logger.info(
         f"[mutate fn] Decreased speed of UAV {lowest_uav_id_trajectory['uav_id']} from {original_speed} to {lowest_uav_id_trajectory['speed']}")
@@ -43,18 +60,18 @@ def change_dir_of_lower_collider(trajectories,
     collision_trajectories = [t for t in trajectories if t.get('collision', False)]
 
     if len(collision_trajectories) <= 1:
-        logger.error(
-            f'[mutate fn] (case2) Not enough collisions to determine lower priority UAV: {collision_trajectories}')
-        return False, f'(case2) Not enough collisions to determine lower priority UAV: {collision_trajectories}'
+        logger.error('[mutate fn] (case2) Not enough collisions to determine lower priority UAV: %s',
+                     summarize(collision_trajectories))
+        return False, f'(case2) Not enough collisions to determine lower priority UAV: {summarize(collision_trajectories)}'
 
-    # Find the trajectory with the highest uav_id (Lower priority)
-    lowest_uav_id_trajectory = max(collision_trajectories,
+    # Find the trajectory with the highest uav_id (Lower priority) of the most urgent conflict
+    lowest_uav_id_trajectory = max(most_urgent_colliders(collision_trajectories),
                                    key=lambda t: t['uav_id'])  #TODO proper priority check + PDOP?
 
     uav_type = lowest_uav_id_trajectory.get('uav_type', None)
     if uav_type is None:
-        logger.error(f'[mutate fn] No uav_type key found in trajectory: {lowest_uav_id_trajectory}')
-        return False, f' No uav_type key found in trajectory: {lowest_uav_id_trajectory}'
+        logger.error('[mutate fn] No uav_type key found in trajectory: %s', summarize(lowest_uav_id_trajectory))
+        return False, f' No uav_type key found in trajectory: {summarize(lowest_uav_id_trajectory)}'
 
     # Retrieve the min_speed and max_speed for the uav_type from abilities
     uav_ability = abilities.get(uav_type, {})
@@ -71,10 +88,8 @@ def change_dir_of_lower_collider(trajectories,
     lowest_uav_id_trajectory['origin'] = 'mutate'  # flag the updated trajectory
     lowest_uav_id_trajectory['mutation_cases'] = f"{int(lowest_uav_id_trajectory.get('mutation_cases', '000'), 2) | 0b010:03b}"  # binary flag for Case 2
 
-    # Remove the "collision" key from each trajectory in collision_trajectories
-    for trajectory in collision_trajectories:
-        if 'collision' in trajectory:
-            del trajectory['collision']
+    # Remove the "collision" and "time_to_conflict" keys from each trajectory in collision_trajectories
+    clear_collision_flags(collision_trajectories)
 
     logger.info(
         f"[mutate fn] changed dir of UAV {lowest_uav_id_trajectory['uav_id']} from {original_dir} to {lowest_uav_id_trajectory['direction']}")
@@ -1,23 +1,170 @@
+import os
+import threading
+
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, sampling
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter
+from opentelemetry.trace import SpanContext, StatusCode, TraceFlags
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+# NOTE: the same module is in every function, keep them in sync
+
+# the collector of the traces, and of the metrics (see metrics.py)
+OTLP_HOST = os.environ.get("OTLP_HOST", "172.17.0.1")
+OTLP_PORT = int(os.environ.get("OTLP_PORT", 4317))
+OTLP_ENDPOINT = f"http://{OTLP_HOST}:{OTLP_PORT}"
+# Share of the traces (started by the first function of a chain) that are exported, the spans of the later functions
+# follow the sampling of their parent
+TRACE_SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", 1.0))
+# Export the spans with an error also when their trace is not sampled. They are recorded, but not exported, otherwise
+TRACE_KEEP_ERRORS = os.environ.get("TRACE_KEEP_ERRORS", "true").lower() == "true"
+TRACE_MAX_ATTRIBUTE_LENGTH = int(os.environ.get("TRACE_MAX_ATTRIBUTE_LENGTH", 2048))  # longer str values are cut, e.g. the input
+TRACE_MAX_EVENTS = int(os.environ.get("TRACE_MAX_EVENTS", 128))  # per span, e.g. the mongo_command events
+TRACE_MAX_QUEUE_SIZE = int(os.environ.get("TRACE_MAX_QUEUE_SIZE", 2048))  # spans waiting for export, the newest are dropped if full
+TRACE_EXPORT_BATCH_SIZE = int(os.environ.get("TRACE_EXPORT_BATCH_SIZE", 512))
+TRACE_EXPORT_DELAY_MS = int(os.environ.get("TRACE_EXPORT_DELAY_MS", 2000))
+if not 0 <= TRACE_SAMPLE_RATIO <= 1:
+    raise ValueError(f'TRACE_SAMPLE_RATIO must be between 0 and 1, got {TRACE_SAMPLE_RATIO}')
+
+
+# the W3C traceparent header carries the trace, and its sampling decision, from one function of the chain to the next
+_propagator = TraceContextTextMapPropagator()
+
+
+def inject_context(headers):
+    # sets the traceparent of the current span in the headers of a call to the next function, see chain_client.post
+    _propagator.inject(headers)
+
+
+def extract_context(headers):
+    # the context of the calling function from the headers of fn (any case), a new trace is started without it
+    return _propagator.extract({key.lower(): value for key, value in (headers or {}).items()})
+
+
+def clip(value):
+    # for the attributes known to be long, cut here instead of by the SpanLimits, which log a warning for each
+    return value[:TRACE_MAX_ATTRIBUTE_LENGTH] if isinstance(value, str) else value
+
+
+class RecordUnsampled(sampling.Sampler):
+    """
+    Records the spans the wrapped sampler drops, without sampling them, so ErrorBiasedSpanProcessor can still export
+    the ones that end with an error.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        result = self.sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision is sampling.Decision.DROP:
+            return sampling.SamplingResult(sampling.Decision.RECORD_ONLY, result.attributes, result.trace_state)
+        return result
+
+    def get_description(self):
+        return f'RecordUnsampled{{{self.sampler.get_description()}}}'
+
+
+def has_error(span):
+    # the functions set the "error" attribute, the SDK sets the status on exceptions escaping a span
+    return bool(span.attributes and span.attributes.get("error")) or span.status.status_code is StatusCode.ERROR
+
+
+def as_sampled(span):
+    # a copy of the span marked as sampled, as the processors of the SDK only export those
+    context = span.context
+    return ReadableSpan(name=span.name,
+                        context=SpanContext(context.trace_id, context.span_id, context.is_remote,
+                                            TraceFlags(context.trace_flags | TraceFlags.SAMPLED), context.trace_state),
+                        parent=span.parent, resource=span.resource, attributes=span.attributes, events=span.events,
+                        links=span.links, kind=span.kind, status=span.status, start_time=span.start_time,
+                        end_time=span.end_time, instrumentation_scope=span.instrumentation_scope)
+
+
+class ErrorBiasedSpanProcessor(SpanProcessor):
+    """
+    Passes the sampled spans, and the recorded but unsampled ones with an error, to the wrapped processor (the
+    BatchSpanProcessor), so both go through its bounded queue.
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def on_start(self, span, parent_context=None):
+        self.processor.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span):
+        if span.context and span.context.trace_flags.sampled:
+            self.processor.on_end(span)
+        elif span.context and has_error(span):
+            self.processor.on_end(as_sampled(span))
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.processor.force_flush(timeout_millis)
+
+
+class DeferredOTLPSpanExporter(SpanExporter):
+    """
+    Imports and creates the OTLP gRPC exporter (about 100 ms of imports) on first use, by fn's warm_up or the first
+    export in the thread of the BatchSpanProcessor, instead of while the function is loaded.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._exporter = None
+        self._lock = threading.Lock()
+
+    def get_exporter(self):
+        with self._lock:
+            if self._exporter is None:
+                from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                self._exporter = OTLPSpanExporter(endpoint=self.endpoint, insecure=True)  # Force plaintext instead of SSL/TLS
+            return self._exporter
+
+    def export(self, spans):
+        return self.get_exporter().export(spans)
+
+    def force_flush(self, timeout_millis=30000):
+        return self._exporter is None or self._exporter.force_flush(timeout_millis)
+
+    def shutdown(self):
+        if self._exporter is not None:
+            self._exporter.shutdown()
+
+
+_exporter = None  # of the TracerInitializer
+
+
+def warm_up():
+    # creates the exporter before the first export, e.g. in fn's warm_up, so spans ended shortly before the instance
+    # stops are exported too (importing gRPC while the interpreter shuts down fails)
+    if _exporter is not None:
+        _exporter.get_exporter()
+
+
 class TracerInitializer:
     def __init__(self, name):
         from opentelemetry import trace
-        from opentelemetry.sdk.trace import TracerProvider, sampling
-        from opentelemetry.sdk.trace.export import (
-            BatchSpanProcessor,
-            ConsoleSpanExporter,
-        )
-        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.trace import TracerProvider, SpanLimits
         from opentelemetry.sdk.resources import Resource
+        global _exporter
 
-        host = "172.17.0.1"
-        port = 4317
+        sampler = sampling.ParentBased(sampling.TraceIdRatioBased(TRACE_SAMPLE_RATIO))
+        keep_errors = TRACE_KEEP_ERRORS and TRACE_SAMPLE_RATIO < 1
+        if keep_errors:
+            sampler = RecordUnsampled(sampler)
         trace.set_tracer_provider(TracerProvider(
             resource=Resource(attributes={"service.name": name}),
-            sampler=sampling.ALWAYS_ON
+            sampler=sampler,
+            span_limits=SpanLimits(max_span_attribute_length=TRACE_MAX_ATTRIBUTE_LENGTH, max_events=TRACE_MAX_EVENTS)
         ))
-        trace.get_tracer_provider().add_span_processor(
-            BatchSpanProcessor(OTLPSpanExporter(endpoint=f"http://{host}:{port}", insecure=True))  # Force plaintext instead of SSL/TLS
-            # BatchSpanProcessor(ConsoleSpanExporter())
-        )
+        _exporter = DeferredOTLPSpanExporter(endpoint=OTLP_ENDPOINT)
+        processor = BatchSpanProcessor(_exporter,
+                                       max_queue_size=TRACE_MAX_QUEUE_SIZE,
+                                       max_export_batch_size=TRACE_EXPORT_BATCH_SIZE,
+                                       schedule_delay_millis=TRACE_EXPORT_DELAY_MS)
+        trace.get_tracer_provider().add_span_processor(ErrorBiasedSpanProcessor(processor) if keep_errors else processor)
 
         self.tracer = trace.get_tracer(__name__)
@@ -0,0 +1,113 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from opentelemetry import trace
+
+import metrics
+from tracer import inject_context
+
+# NOTE: the same module is in every function, keep them in sync
+
+TINYFAAS_HOST = os.environ.get("TINYFAAS_HOST", "172.17.0.1")  # "host.docker.internal" from Docker Desktop
+TINYFAAS_PORT = int(os.environ.get("TINYFAAS_PORT", 8000))
+CHAIN_CONNECT_TIMEOUT_S = float(os.environ.get("CHAIN_CONNECT_TIMEOUT_S", 1))
+CHAIN_READ_TIMEOUT_S = float(os.environ.get("CHAIN_READ_TIMEOUT_S", 5))
+CHAIN_RETRIES = int(os.environ.get("CHAIN_RETRIES", 3))  # retries after the first attempt, if the connection is not opened
+CHAIN_RETRY_BACKOFF_S = float(os.environ.get("CHAIN_RETRY_BACKOFF_S", 0.05))
+CHAIN_POOL_SIZE = int(os.environ.get("CHAIN_POOL_SIZE", 16))  # kept-alive connections to the gateway
+
+# Set up Python logger
+logger = logging.getLogger(__name__)
+
+# One session per process, its connections to the tinyFaaS gateway are kept alive across invocations
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # requests (about 100 ms of imports) is loaded on first use, by the warm-up or the first hop, not with the function
+    global _session
+    if _session is not None:
+        return _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=CHAIN_POOL_SIZE, max_retries=0))
+            _session = session
+        return _session
+
+
+def function_url(function_name):
+    return f"http://{TINYFAAS_HOST}:{TINYFAAS_PORT}/{function_name}"
+
+
+def is_not_sent(error):
+    # the connection to the gateway was not opened (refused, unreachable or timed out), so the request was not sent.
+    # A connection that breaks after that (e.g. a kept-alive one closed by the gateway) is a ProtocolError instead
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def post(function_name, **kwargs):
+    """
+    POSTs to the next function of the chain over the pooled session. Retries with exponential backoff and full jitter
+    when the connection cannot be opened, but not when it breaks or the gateway does not respond in time once the
+    request is (possibly) sent, as the gateway may have accepted the call and the next function would run twice.
+    The latency of the hop and the attempts are set on the current span, the latency is also recorded as the
+    'downstream' stage. The traceparent of the current span is sent along, so the next function continues the trace.
+    Args:
+        function_name: name of the tinyFaaS function, the path of its URL
+        kwargs: passed on to requests, e.g. headers and json or data
+
+    Returns:
+        the requests.Response
+    """
+    session = get_session()
+    import requests  # loaded by get_session
+
+    url = function_url(function_name)
+    kwargs["headers"] = dict(kwargs.get("headers") or {})
+    inject_context(kwargs["headers"])
+    span = trace.get_current_span()
+    start = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            try:
+                return session.post(url, timeout=(CHAIN_CONNECT_TIMEOUT_S, CHAIN_READ_TIMEOUT_S), **kwargs)
+            except requests.exceptions.ConnectionError as e:  # includes ConnectTimeout, but not ReadTimeout
+                if attempt > CHAIN_RETRIES or not is_not_sent(e):
+                    raise
+                delay = random.uniform(0, CHAIN_RETRY_BACKOFF_S * 2 ** (attempt - 1))
+                logger.warning(f'[chain client] calling {url} failed ({e}), retry {attempt} in {delay * 1000:.0f} ms')
+                time.sleep(delay)
+    finally:
+        span.set_attribute("hop_target", function_name)
+        span.set_attribute("hop_attempts", attempt)
+        latency_ms = (time.perf_counter() - start) * 1000
+        span.set_attribute("hop_latency_ms", latency_ms)
+        metrics.STAGE_DURATION.record(latency_ms, {"stage": "downstream", "target": function_name})
+
+
+def warm_up():
+    # opens a kept-alive connection to the gateway, so the first hop does not wait for it
+    session = get_session()
+    import requests  # loaded by get_session
+
+    url = function_url("")
+    start = time.perf_counter()
+    try:
+        session.head(url, timeout=(CHAIN_CONNECT_TIMEOUT_S, CHAIN_READ_TIMEOUT_S))
+        logger.info(f'[chain client] connected to {url} in {(time.perf_counter() - start) * 1000:.1f} ms')
+    except requests.exceptions.RequestException as e:  # the hops retry on connection errors
+        logger.warning(f'[chain client] warm-up request to {url} failed: {e}')
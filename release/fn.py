@@ -1,27 +1,30 @@
 #!/usr/bin/env python3
 
+import cold_start  # first, it marks when loading the function started
 import json
+import os
+import threading
 import typing
 import logging
-import paho.mqtt.client as mqtt
 
 from call_next_func import post_update
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
-
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import metrics
+import wire_format
+
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging()
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("release").tracer
 
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("release")
+INVOCATIONS = metrics.InvocationCounter()
+
 # Set up MQTT client
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
@@ -30,13 +33,34 @@ def on_connect(client, userdata, flags, rc):
         print("Failed to connect, return code %d\n", rc)
 
 
-HOST = "172.17.0.1"  # TODO: import from ENV
-PORT = 1883
+MQTT_HOST = os.environ.get("MQTT_HOST", "172.17.0.1")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
 QOS = 1  # At least once delivery
-CLIENT = mqtt.Client()
-CLIENT.on_connect = on_connect
-CLIENT.connect(HOST, PORT, 60)
-CLIENT.loop_start()  # Start the loop in a separate thread. it was needed on raspberry to publishes work
+MQTT_ERR_SUCCESS = 0  # paho.mqtt.client.MQTT_ERR_SUCCESS, paho is only imported by get_mqtt_client
+_mqtt_client = None
+_mqtt_client_lock = threading.Lock()
+
+
+def get_mqtt_client():
+    # imports paho and connects on first use, by the warm-up or the first invocation, not while the function is loaded
+    global _mqtt_client
+    with _mqtt_client_lock:
+        if _mqtt_client is None:
+            import paho.mqtt.client as mqtt
+            client = mqtt.Client()
+            client.on_connect = on_connect
+            client.connect(MQTT_HOST, MQTT_PORT, 60)
+            client.loop_start()  # Start the loop in a separate thread. it was needed on raspberry to publishes work
+            _mqtt_client = client
+        return _mqtt_client
+
+
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    chain_client.warm_up()
+    get_mqtt_client()
 
 
 def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
@@ -44,14 +68,21 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
     input: trajectories needed to be released and update
     output: publishes the data to the '/release' topic, and calls the update function
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[release fn] invoke count: {str(Counter.get_count())}')
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[release fn] Parsed input: {parsed_input}')
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("release", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[release fn] invoke count: {invoke_count}')
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[release fn] Parsed input: %s', summarize(parsed_input))
 
             data = parsed_input.get('data', [])
             meta = parsed_input.get('meta', {})
@@ -59,16 +90,24 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
         # Select elements where 'origin' is 'mutated'
         with tracer.start_as_current_span('filter_mutated_elems'):
             mutated_data = list(filter(lambda item: item.get('origin', None) == 'mutate', data))
-            logger.debug(f'[release fn] Mutated data to release: {mutated_data}')
+            logger.debug('[release fn] Mutated data to release: %s', summarize(mutated_data))
 
         # Publish the trajectories to the 'release' topic
         with tracer.start_as_current_span('publish_release') as pub_span:
             pub_span.set_attribute("QoS", QOS)
-            result, mid = CLIENT.publish('releases', json.dumps(mutated_data), qos=QOS)
-            if result == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f'[release fn] Published mutated_data to releases topic: {mutated_data}')
-            else:
-                logger.error(f'[release fn] Failed to publish to releases topic, result code: {result}')
+            try:
+                result, mid = get_mqtt_client().publish('releases', json.dumps(mutated_data), qos=QOS)
+                if result == MQTT_ERR_SUCCESS:
+                    metrics.RELEASES.add(len(mutated_data))
+                    logger.info('[release fn] Published mutated_data to releases topic: %s', summarize(mutated_data))
+                else:
+                    logger.error(f'[release fn] Failed to publish to releases topic, result code: {result}')
+                    metrics.record_error("publish_release")
+            except Exception as e:  # e.g. the broker is not reachable, the update is still called
+                logger.error(f'[release fn] Error connecting to {MQTT_HOST}:{MQTT_PORT}: {e}')
+                pub_span.set_attribute("error", True)
+                metrics.record_error("publish_release")
+                pub_span.set_attribute("error_details", e)
 
         # call update function
         with tracer.start_as_current_span('post_update') as post_update_span:
@@ -78,23 +117,10 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
             except Exception as e:
                 logger.error(f'[release fn] Error in post_update: {e}')
                 post_update_span.set_attribute("error", True)
+                metrics.record_error("post_update")
                 post_update_span.set_attribute("error_details", e)
 
         return str("release func. check logs for details")
 
 
-class Counter:
-    count = None
-
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
-
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+cold_start.loaded("release", warm_up)
@@ -0,0 +1,110 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from opentelemetry import metrics as otel_metrics
+from opentelemetry.sdk.metrics.export import MetricExporter
+
+from tracer import OTLP_ENDPOINT
+
+# NOTE: the same module is in every function, keep them in sync
+
+# the instruments are no-ops without METRICS, e.g. if the OTLP endpoint takes traces only (Jaeger all-in-one)
+METRICS = os.environ.get("METRICS", "true").lower() == "true"
+METRICS_EXPORT_INTERVAL_MS = int(os.environ.get("METRICS_EXPORT_INTERVAL_MS", 10000))
+
+# The instruments can be used before MetricsInitializer sets up the provider, the API forwards them to it then.
+# Latencies are one histogram, per 'stage': parse, mongo, detection, mutation and downstream (the calls to the next
+# function). Counts are per function, which is the service.name of the exported resource.
+meter = otel_metrics.get_meter(__name__)
+STAGE_DURATION = meter.create_histogram("stage.duration", unit="ms", description="Latency of a stage of the function")
+INVOCATIONS = meter.create_counter("invocations", description="Invocations of the function")
+COLLISIONS = meter.create_counter("collisions", description="Conflicting pairs of UAVs detected")
+MUTATIONS = meter.create_counter("mutations", description="Trajectories mutated")
+RELEASES = meter.create_counter("releases", description="Trajectories published to the releases topic")
+ERRORS = meter.create_counter("errors", description="Errors, per stage (the span they are recorded on)")
+FLEET_SIZE = meter.create_gauge("fleet.size", description="UAVs in the last collision detection")
+
+
+@contextmanager
+def timed(stage, **attributes):
+    # records the duration of the with block in STAGE_DURATION, also when it raises or returns
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.record((time.perf_counter() - start) * 1000, dict(attributes, stage=stage))
+
+
+def record_error(stage):
+    ERRORS.add(1, {"stage": stage})
+
+
+class InvocationCounter:
+    """
+    Numbers the invocations of the instance, for the span and the logs, and counts them in INVOCATIONS.
+    """
+
+    def __init__(self):
+        self._count = itertools.count(1)  # next() is atomic, concurrent invocations get distinct numbers
+
+    def increment(self):
+        INVOCATIONS.add(1)
+        return next(self._count)
+
+
+class DeferredOTLPMetricExporter(MetricExporter):
+    """
+    Like tracer.DeferredOTLPSpanExporter: the OTLP gRPC exporter is imported and created on first use, by fn's warm_up
+    or the first export in the thread of the PeriodicExportingMetricReader.
+    """
+
+    def __init__(self, endpoint):
+        super().__init__()  # cumulative temporality and default aggregations, as the OTLP exporter
+        self.endpoint = endpoint
+        self._exporter = None
+        self._lock = threading.Lock()
+
+    def get_exporter(self):
+        with self._lock:
+            if self._exporter is None:
+                from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+                self._exporter = OTLPMetricExporter(endpoint=self.endpoint, insecure=True)  # Force plaintext instead of SSL/TLS
+            return self._exporter
+
+    def export(self, metrics_data, timeout_millis=10_000, **kwargs):
+        return self.get_exporter().export(metrics_data, timeout_millis=timeout_millis, **kwargs)
+
+    def force_flush(self, timeout_millis=10_000):
+        return self._exporter is None or self._exporter.force_flush(timeout_millis)
+
+    def shutdown(self, timeout_millis=30_000, **kwargs):
+        if self._exporter is not None:
+            self._exporter.shutdown(timeout_millis=timeout_millis, **kwargs)
+
+
+_exporter = None  # of the MetricsInitializer
+
+
+def warm_up():
+    # creates the exporter before the first export, see tracer.warm_up
+    if _exporter is not None:
+        _exporter.get_exporter()
+
+
+class MetricsInitializer:
+    def __init__(self, name):
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.sdk.resources import Resource
+        global _exporter
+
+        if not METRICS:
+            return
+        _exporter = DeferredOTLPMetricExporter(OTLP_ENDPOINT)
+        otel_metrics.set_meter_provider(MeterProvider(
+            resource=Resource(attributes={"service.name": name}),
+            metric_readers=[PeriodicExportingMetricReader(_exporter, export_interval_millis=METRICS_EXPORT_INTERVAL_MS)]
+        ))
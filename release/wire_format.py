@@ -0,0 +1,93 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+# NOTE: the same module is in every function, keep them in sync
+
+# Encoding of the payloads sent to the next function: 'json' (default, what the ingester sends), 'orjson' (same JSON,
+# faster codec) or 'msgpack'. Every function decodes all of them, according to the Content-Type of the request
+WIRE_FORMAT = os.environ.get("WIRE_FORMAT", "json")
+# 'zstd' compresses payloads of at least WIRE_COMPRESSION_MIN_BYTES, e.g. the snapshots of large fleets
+WIRE_COMPRESSION = os.environ.get("WIRE_COMPRESSION", "none")
+WIRE_COMPRESSION_MIN_BYTES = int(os.environ.get("WIRE_COMPRESSION_MIN_BYTES", 16384))
+WIRE_COMPRESSION_LEVEL = int(os.environ.get("WIRE_COMPRESSION_LEVEL", 3))
+if WIRE_FORMAT not in ("json", "orjson", "msgpack"):
+    raise ValueError(f'Unknown WIRE_FORMAT: {WIRE_FORMAT}. Expected one of {["json", "orjson", "msgpack"]}')
+if WIRE_COMPRESSION not in ("none", "zstd"):
+    raise ValueError(f'Unknown WIRE_COMPRESSION: {WIRE_COMPRESSION}. Expected one of {["none", "zstd"]}')
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+
+def to_serializable(o):
+    # ObjectId from MongoDB and datetime are not serializable by default, they are sent as str
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)  # ObjectId, without importing bson in the functions that do not use Mongo
+
+
+def encode(payload):
+    """
+    Returns:
+        body, content_type: the payload in WIRE_FORMAT, and the Content-Type to send it with. tinyFaaS hands the body
+        to fn as a str, so binary (msgpack or compressed) bodies are base64 encoded, marked by an 'encoding' parameter
+    """
+    params = []
+    if WIRE_FORMAT == "msgpack":
+        import msgpack
+        media_type = MSGPACK
+        raw = msgpack.packb(payload, default=to_serializable)
+    elif WIRE_FORMAT == "orjson":
+        import orjson
+        media_type = JSON
+        raw = orjson.dumps(payload, default=to_serializable)
+    else:
+        media_type = JSON
+        raw = json.dumps(payload, default=to_serializable).encode()
+
+    if WIRE_COMPRESSION == "zstd" and len(raw) >= WIRE_COMPRESSION_MIN_BYTES:
+        import zstandard
+        raw = zstandard.ZstdCompressor(level=WIRE_COMPRESSION_LEVEL).compress(raw)
+        params.append("compression=zstd")
+    if media_type == MSGPACK or params:
+        params.append("encoding=base64")
+        body = base64.b64encode(raw)
+    else:
+        body = raw
+    return body, "; ".join([media_type] + params)
+
+
+def content_type_of(headers):
+    for key, value in (headers or {}).items():
+        if key.lower() == "content-type":
+            return value
+    return JSON
+
+
+def decode(body, headers):
+    """
+    Args:
+        body: the input of fn
+        headers: the headers of fn, a missing Content-Type is taken as JSON
+
+    Returns:
+        the decoded payload
+    """
+    media_type, *params = [part.strip() for part in content_type_of(headers).split(";")]
+    params = dict(param.split("=", 1) for param in params if "=" in param)
+    raw = body
+    if params.get("encoding") == "base64":
+        raw = base64.b64decode(body)
+    if params.get("compression") == "zstd":
+        import zstandard
+        raw = zstandard.ZstdDecompressor().decompress(raw)
+    if media_type == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(raw)
+    try:
+        import orjson
+        return orjson.loads(raw)
+    except ImportError:
+        return json.loads(raw)
@@ -0,0 +1,70 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TriggerBatch:
+    """
+    The triggers merged into one detection run. changed_uav_ids is the union of the UAVs that reported, None if any of
+    the triggers did not name them (then the run checks all pairs). reports holds the reports the triggers carried.
+    """
+    __slots__ = ("triggers", "changed_uav_ids", "reports", "closed")
+
+    def __init__(self):
+        self.triggers = 0
+        self.changed_uav_ids = set()
+        self.reports = []
+        self.closed = False
+
+    def add(self, changed_uav_ids, reports=()):
+        self.triggers += 1
+        self.reports.extend(reports)
+        if changed_uav_ids is None or self.changed_uav_ids is None:
+            self.changed_uav_ids = None
+        else:
+            self.changed_uav_ids.update(changed_uav_ids)
+
+
+class TriggerCoalescer:
+    """
+    Collapses bursts of triggers into one detection run. The first trigger of a batch leads it: it waits for the
+    window, then for the run in flight (if any) to finish, and runs the detection for the whole batch. Triggers that
+    arrive until then join the batch and return right away. So at most one run is in flight and one batch is pending.
+    """
+
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self.absorbed = 0  # triggers merged into another one's run, since the start of the instance
+        self.runs = 0
+        self._lock = threading.Lock()  # guards the pending batch and the counters
+        self._run_lock = threading.Lock()  # held by the leader of the run in flight
+        self._pending = None
+
+    def join(self, changed_uav_ids, reports=()):
+        """
+        Args:
+            changed_uav_ids: the UAVs the trigger reports, None if unknown
+            reports: the reports the trigger carries
+
+        Returns:
+            the pending batch, and whether the caller leads it (True) or was absorbed into it (False)
+        """
+        with self._lock:
+            leader = self._pending is None
+            if leader:
+                self._pending = TriggerBatch()
+            else:
+                self.absorbed += 1
+            self._pending.add(changed_uav_ids, reports)
+            return self._pending, leader
+
+    @contextmanager
+    def leading(self, batch):
+        # used by the leader of the batch, the detection runs in the with block
+        time.sleep(self.window_seconds)
+        with self._run_lock:
+            with self._lock:
+                batch.closed = True  # later triggers start the next batch
+                self._pending = None
+                self.runs += 1
+            yield batch
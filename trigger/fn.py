@@ -1,120 +1,202 @@
 #!/usr/bin/env python3
 
+import cold_start  # first, it marks when loading the function started
 import json
 import typing
 import logging
+import math
+import os
+import time
 import uuid
 
 from call_next_func import post_collision_detector
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
-from get_recent_trajectories import get_recent_trajectories
-from json_encoder import JSONEncoder
-
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import mongo_client
+import metrics
+import wire_format
+from get_recent_trajectories import get_recent_trajectories, get_recent_bucketed_trajectories, get_latest_states, \
+    get_neighbourhood_states, parse_reports, merge_reports
+from coalescer import TriggerCoalescer
+
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging()
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("trigger").tracer
 
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("trigger")
+INVOCATIONS = metrics.InvocationCounter()
+
 TTL = 100  # seconds
+# 'latest_state' (default) reads the per-UAV snapshot update maintains, 'history' reduces the trajectories collection
+SNAPSHOT_SOURCE = os.environ.get("SNAPSHOT_SOURCE", "latest_state")
+# layout of the history update writes, see update/store_update.py
+HISTORY_LAYOUT = os.environ.get("HISTORY_LAYOUT", "documents")
+SNAPSHOT_READERS = {"latest_state": get_latest_states,
+                    "history": get_recent_bucketed_trajectories if HISTORY_LAYOUT == "buckets" else get_recent_trajectories}
+if SNAPSHOT_SOURCE not in SNAPSHOT_READERS:
+    raise ValueError(f'Unknown SNAPSHOT_SOURCE: {SNAPSHOT_SOURCE}. Expected one of {list(SNAPSHOT_READERS)}')
+# with NEIGHBOURHOOD_SCOPE, only the UAVs that can get within separation of a reporting UAV over the prediction horizon
+# are sent to the detector (needs SNAPSHOT_SOURCE=latest_state and changed_uav_ids in meta)
+NEIGHBOURHOOD_SCOPE = os.environ.get("NEIGHBOURHOOD_SCOPE", "true").lower() == "true"
+TIME_INTERVAL = 1; NUM_STEPS = 10; HORIZONTAL_SEPARATION = 1  # as in collision-detector/fn.py
+KM_PER_DEGREE = math.pi / 180 * 6371
+# Load abilities from JSON file, same as mutate's
+with open('abilities.json', 'r') as f:
+    abilities = json.load(f)
+MAX_SPEED = max(ability["max_speed"] for ability in abilities.values())
+
+
+def neighbourhood_radius_km(reporter):
+    """
+    The reporter at its speed and any other UAV at MAX_SPEED flying towards each other over the horizon, plus the separation.
+    The detector's model adds the distance of speed / 3600 * time to the degrees of latitude and longitude, so it is
+    converted with the km of a degree of latitude (a degree of longitude is shorter) to bound that model's reach.
+    """
+    horizon = (NUM_STEPS - 1) * TIME_INTERVAL
+    return (reporter["speed"] + MAX_SPEED) / 3600 * horizon * KM_PER_DEGREE + HORIZONTAL_SEPARATION
+
+
+# with a window > 0, triggers arriving while a detection run is pending or in flight are merged into the next run
+TRIGGER_COALESCE_WINDOW_MS = float(os.environ.get("TRIGGER_COALESCE_WINDOW_MS", 0))
+COALESCER = TriggerCoalescer(TRIGGER_COALESCE_WINDOW_MS / 1000) if TRIGGER_COALESCE_WINDOW_MS > 0 else None
+
+
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    mongo_client.warm_up()
+    chain_client.warm_up()
+
 
 def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
     """
     input: gets a new trajectory. Invoked by the update function
     output: calls the risk-eval function with the recent trajectories from the db
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[trigger fn] invoke count: {str(Counter.get_count())}')
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[trigger fn] Parsed input: {parsed_input}')
-
-            # data = parsed_input.get('data', []) # no data expected
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("trigger", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[trigger fn] invoke count: {invoke_count}')
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[trigger fn] Parsed input: %s', summarize(parsed_input))
+
+            # the reports update stored (or is storing) at the same time, merged into the snapshot
+            reports = parse_reports(parsed_input.get('data') or [])
             meta = parsed_input.get('meta', {})
 
         # Check the 'origin' in 'meta'
         origin = meta.get('origin', None)
         if origin is None:
-            logger.error(f'[trigger fn] No origin key found in meta. dump: {meta}')
+            logger.error('[trigger fn] No origin key found in meta. dump: %s', summarize(meta))
             main_span.set_attribute("error", True)
+            metrics.record_error("fn")
             main_span.set_attribute("error_details", "No origin key found in meta")
-            return f'No origin key found in meta. dump: {meta}'
+            return f'No origin key found in meta. dump: {summarize(meta)}'
 
         # Check if 'origin' is 'self_report'
         if origin != 'self_report':
-            logger.error(f'[trigger fn] Origin is not self_report. dump: {meta}')
+            logger.error('[trigger fn] Origin is not self_report. dump: %s', summarize(meta))
             main_span.set_attribute("error", True)
+            metrics.record_error("fn")
             main_span.set_attribute("error_details", "Origin is not self_report")
-            return f'Origin is not self_report. dump: {meta}'
-
-        # Generate a unique request_id and add it to the meta dictionary
-        with tracer.start_as_current_span('gen_req_uid') as gen_req_uid_span:
-            request_id = str(uuid.uuid4())
-            meta['request_id'] = request_id
-            logger.info(f'[trigger fn] Generated request_id: {request_id}')
-            gen_req_uid_span.set_attribute("request_id", request_id)
-
-        # TODO: get the ttl from ENV
-        # TODO: if db is slow, call it in parallel with previous code
-        # Get recent trajectory from each uav (limited by ttl, in seconds)
-        # includes the trajectory from the update (already in db)
-        with tracer.start_as_current_span('get_recent_trajectories', attributes={"ttl": TTL}) as get_recent_trajectories_span:
-            try:
-                recent_trajectories = get_recent_trajectories(TTL)
-            except Exception as e:
-                logger.error(f'[trigger fn] Error in get_recent_trajectories: {e}')
-                get_recent_trajectories_span.set_attribute("error", True)
-                get_recent_trajectories_span.set_attribute("error_details", e)
-                return f'Error in get_recent_trajectories: {e}'
-
-        # Check if recent_trajectories is not empty, else call risk-eval function
-        with tracer.start_as_current_span('post_risk_eval_if_any_traj') as post_risk_eval_if_any_traj_span:
-            post_risk_eval_if_any_traj_span.set_attribute("recent_trajectories_size", len(recent_trajectories))
-            if not recent_trajectories:
-                logger.error(f'[trigger fn] No recent trajectories found')
-                post_risk_eval_if_any_traj_span.set_attribute("error", True)
-                post_risk_eval_if_any_traj_span.set_attribute("error_details", "No recent trajectories found")
-                return f'No recent trajectories found'
+            return f'Origin is not self_report. dump: {summarize(meta)}'
+
+        # Merge bursts of triggers into one detection run, if coalescing is on
+        if COALESCER is None:
+            return detect_recent_trajectories(meta, reports)
+        batch, leader = COALESCER.join(meta.get('changed_uav_ids'), reports)
+        main_span.set_attribute("coalesce_leader", leader)
+        main_span.set_attribute("absorbed_triggers_total", COALESCER.absorbed)
+        if not leader:
+            logger.info(f'[trigger fn] absorbed into the pending detection run ({COALESCER.absorbed} absorbed in total)')
+            return 'Absorbed into the pending detection run'
+        window_start = time.perf_counter()
+        with COALESCER.leading(batch):
+            main_span.set_attribute("coalesce_wait_ms", (time.perf_counter() - window_start) * 1000)
+            main_span.set_attribute("coalesced_triggers", batch.triggers)
+            main_span.set_attribute("coalesce_runs_total", COALESCER.runs)
+            logger.info(f'[trigger fn] running the detection for {batch.triggers} coalesced triggers')
+            if batch.changed_uav_ids is None:
+                meta.pop('changed_uav_ids', None)
             else:
-                logger.info(
-                    f'[trigger fn] Found {len(recent_trajectories)} trajectories for uav_ids: {[trajectory["uav_id"] for trajectory in recent_trajectories]}')
-                # call risk-eval function
-                with tracer.start_as_current_span('post_risk_eval') as post_risk_eval_span:
-                    with tracer.start_as_current_span('json_encode_recent_trajectories'):
-                        encoded_recent_trajectories = [JSONEncoder().default(trajectory) for trajectory in recent_trajectories]
-                    try:
-                        r = post_collision_detector(encoded_recent_trajectories, meta)
-                        post_risk_eval_span.set_attribute("response_code", r.status_code)
-                    except Exception as e:
-                        logger.error(f'[trigger fn] Error in post_risk_eval: {e}')
-                        post_risk_eval_span.set_attribute("error", True)
-                        post_risk_eval_span.set_attribute("error_details", e)
-                    return str(encoded_recent_trajectories)
-
-
-class Counter:
-    count = None
-
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
-
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+                meta['changed_uav_ids'] = sorted(batch.changed_uav_ids)
+            return detect_recent_trajectories(meta, batch.reports)
+
+
+def detect_recent_trajectories(meta, reports):
+    """
+    Reads the fleet snapshot, merges the reports into it and calls the collision detector with it, for one (possibly
+    coalesced) trigger
+    """
+    # Generate a unique request_id and add it to the meta dictionary
+    with tracer.start_as_current_span('gen_req_uid') as gen_req_uid_span:
+        request_id = str(uuid.uuid4())
+        meta['request_id'] = request_id
+        logger.info(f'[trigger fn] Generated request_id: {request_id}')
+        gen_req_uid_span.set_attribute("request_id", request_id)
+
+    # TODO: get the ttl from ENV
+    # TODO: if db is slow, call it in parallel with previous code
+    # Get recent trajectory from each uav (limited by ttl, in seconds)
+    # the reports carried by the trigger are merged in, whether update already wrote them or not
+    with tracer.start_as_current_span('get_recent_trajectories', attributes={"ttl": TTL, "snapshot_source": SNAPSHOT_SOURCE}) as get_recent_trajectories_span:
+        try:
+            recent_trajectories = None
+            changed_uav_ids = meta.get('changed_uav_ids')
+            if NEIGHBOURHOOD_SCOPE and SNAPSHOT_SOURCE == 'latest_state' and changed_uav_ids:
+                recent_trajectories = get_neighbourhood_states(TTL, changed_uav_ids, neighbourhood_radius_km,
+                                                               reports)
+            get_recent_trajectories_span.set_attribute("neighbourhood_scope", recent_trajectories is not None)
+            if recent_trajectories is None:  # the whole airspace
+                recent_trajectories = SNAPSHOT_READERS[SNAPSHOT_SOURCE](TTL)
+            get_recent_trajectories_span.set_attribute("carried_reports", len(reports))
+            recent_trajectories = merge_reports(recent_trajectories, reports)
+        except Exception as e:
+            logger.error(f'[trigger fn] Error in get_recent_trajectories: {e}')
+            get_recent_trajectories_span.set_attribute("error", True)
+            metrics.record_error("get_recent_trajectories")
+            get_recent_trajectories_span.set_attribute("error_details", e)
+            return f'Error in get_recent_trajectories: {e}'
+
+    # Check if recent_trajectories is not empty, else call risk-eval function
+    with tracer.start_as_current_span('post_risk_eval_if_any_traj') as post_risk_eval_if_any_traj_span:
+        post_risk_eval_if_any_traj_span.set_attribute("recent_trajectories_size", len(recent_trajectories))
+        if not recent_trajectories:
+            logger.error(f'[trigger fn] No recent trajectories found')
+            post_risk_eval_if_any_traj_span.set_attribute("error", True)
+            metrics.record_error("post_risk_eval_if_any_traj")
+            post_risk_eval_if_any_traj_span.set_attribute("error_details", "No recent trajectories found")
+            return f'No recent trajectories found'
+        else:
+            logger.info('[trigger fn] Found %d trajectories: %s', len(recent_trajectories),
+                        summarize(recent_trajectories))
+            # call risk-eval function
+            with tracer.start_as_current_span('post_risk_eval') as post_risk_eval_span:
+                # ObjectId and datetime are converted while the payload is encoded, in one pass
+                try:
+                    r = post_collision_detector(recent_trajectories, meta)
+                    post_risk_eval_span.set_attribute("response_code", r.status_code)
+                except Exception as e:
+                    logger.error(f'[trigger fn] Error in post_risk_eval: {e}')
+                    post_risk_eval_span.set_attribute("error", True)
+                    metrics.record_error("post_risk_eval")
+                    post_risk_eval_span.set_attribute("error_details", e)
+                return str(recent_trajectories)
+
+
+cold_start.loaded("trigger", warm_up)
@@ -1,34 +1,181 @@
-from pymongo import MongoClient
+import logging
+import os
+
+from pymongo import ASCENDING, DESCENDING
 from datetime import datetime, timedelta
 
+from log_setup import summarize
+from mongo_client import db
+
+logger = logging.getLogger(__name__)
+
+R = 6371  # Radius of the Earth in kilometers, same as collision-detector/utility.haversine
+# documents per round trip of a cursor, bounds the documents the driver buffers at once
+SNAPSHOT_BATCH_SIZE = int(os.environ.get("SNAPSHOT_BATCH_SIZE", 500))
+
+# The lean trajectory schema sent to the collision detector: '_id' (the history document, as str), these fields, and
+# 'created_at' (as ISO 8601 str) to merge the carried reports. Other stored fields are not read from the db.
+# The detectors need the required fields, the optional ones are passed on if a report has them (mutate checks uav_type)
+REQUIRED_FIELDS = ("uav_id", "latitude", "longitude", "altitude", "speed", "direction", "vertical_speed")
+OPTIONAL_FIELDS = ("uav_type",)
+LEAN_FIELDS = REQUIRED_FIELDS + OPTIONAL_FIELDS
+LEAN_PROJECTION = dict.fromkeys(LEAN_FIELDS + ("created_at",), True)
+
+
+def lean_trajectory(document, id_field='_id'):
+    # the only conversion of a stored document, done while the cursor streams
+    trajectory = {'_id': str(document[id_field])}
+    for field in REQUIRED_FIELDS:
+        trajectory[field] = document[field]
+    for field in OPTIONAL_FIELDS:
+        if document.get(field) is not None:
+            trajectory[field] = document[field]
+    created_at = document['created_at']
+    trajectory['created_at'] = created_at if isinstance(created_at, str) else created_at.isoformat()
+    return trajectory
+
+
+def lean_trajectories(documents, id_field='_id'):
+    # a document without a required field is left out (and logged), instead of failing the whole detection run
+    trajectories = []
+    for document in documents:
+        try:
+            trajectories.append(lean_trajectory(document, id_field))
+        except (KeyError, TypeError, AttributeError) as e:
+            logger.warning('[trigger fn] skipping an invalid trajectory (%s: %s): %s', type(e).__name__, e,
+                           summarize(document))
+    return trajectories
+
+
+def lean_states(cursor):
+    # latest_state documents carry the _id of their history document as trajectory_id
+    return lean_trajectories(cursor, 'trajectory_id')
+
+
+# supports the $match and $sort of the pipeline below, created once per process (create_index is a no-op if it exists)
+RECENT_INDEX = [('created_at', DESCENDING), ('uav_id', ASCENDING)]
+_indexed_collections = set()
+
+
+def ensure_recent_index(collection):
+    if collection.name not in _indexed_collections:
+        collection.create_index(RECENT_INDEX, name='created_at_-1_uav_id_1', background=True)
+        _indexed_collections.add(collection.name)
 
-def get_recent_trajectories(seconds_ago):
-    # Create a MongoClient to the running MongoDB instance
-    host = "172.17.0.1"  # TODO use ENV variables
-    client = MongoClient(f'mongodb://{host}:27017/')
 
-    # Access the 'trajectories' collection in the 'sixGNext' database
-    db = client.sixGNext
+def get_latest_states(seconds_ago):
+    """
+    Reads the fleet snapshot from the 'latest_state' collection that update maintains, one document per UAV, in a
+    single scan of its created_at index. The cost is O(active UAVs), whatever the report rate and history size.
+    Returns:
+        the most recent lean trajectory of each 'uav_id' not older than seconds_ago
+    """
+    latest_state = db.latest_state
+
+    ttl = datetime.now() - timedelta(seconds=seconds_ago)
+    return lean_states(latest_state.find({'created_at': {'$gte': ttl}}, dict(LEAN_PROJECTION, trajectory_id=True),
+                                         batch_size=SNAPSHOT_BATCH_SIZE))
+
+
+def parse_reports(data):
+    """
+    Args:
+        data: the reports update passes on, stamped with '_id' and 'created_at'
+
+    Returns:
+        the reports as lean trajectories, without the ones missing a required field
+    """
+    return lean_trajectories(data)
+
+
+def merge_reports(snapshot, reports):
+    """
+    Merges the reports into the snapshot read from the db, which may have been read before (or after) they are
+    written. A report replaces the stored trajectory of its UAV, unless that is newer.
+    Returns:
+        the merged snapshot, one trajectory per 'uav_id'
+    """
+    merged = {trajectory['uav_id']: trajectory for trajectory in snapshot}
+    for report in reports:
+        stored = merged.get(report['uav_id'])
+        if stored is None or (datetime.fromisoformat(stored['created_at']) <=
+                              datetime.fromisoformat(report['created_at'])):
+            merged[report['uav_id']] = report
+    return list(merged.values())
+
+
+def get_neighbourhood_states(seconds_ago, uav_ids, radius_km, reports=()):
+    """
+    Like get_latest_states, but only the UAVs within a radius of the given (reporting) UAVs, found with the 2dsphere
+    index on the 'location' update writes to 'latest_state'.
+    Args:
+        seconds_ago: ttl of the states, in seconds
+        uav_ids: the UAVs whose neighbourhoods are read
+        radius_km: function of a reporter's state, returning the radius of its neighbourhood in kilometers
+        reports: the reporters' states at hand, only the other uav_ids are looked up
+
+    Returns:
+        the lean trajectories in the union of the neighbourhoods (including the reporters). None if none of the uav_ids has a recent state, the caller then reads the whole snapshot.
+    """
+    latest_state = db.latest_state
+
+    ttl = datetime.now() - timedelta(seconds=seconds_ago)
+    reporters = list(reports)
+    missing_uav_ids = set(uav_ids) - {report['uav_id'] for report in reporters}
+    if missing_uav_ids:
+        reporters.extend(lean_states(latest_state.find(
+            {'uav_id': {'$in': list(missing_uav_ids)}, 'created_at': {'$gte': ttl}},
+            dict(LEAN_PROJECTION, trajectory_id=True))))
+    if not reporters:
+        return None
+    neighbourhoods = [{'location': {'$geoWithin': {'$centerSphere': [
+        [(reporter['longitude'] + 180) % 360 - 180, max(-90.0, min(90.0, reporter['latitude']))],
+        radius_km(reporter) / R]}}} for reporter in reporters]
+    return lean_states(latest_state.find({'created_at': {'$gte': ttl}, '$or': neighbourhoods},
+                                         dict(LEAN_PROJECTION, trajectory_id=True), batch_size=SNAPSHOT_BATCH_SIZE))
+
+
+def get_recent_trajectories(seconds_ago):
+    # Access the 'trajectories' collection through the pooled client of the process
     trajectories = db.trajectories
+    ensure_recent_index(trajectories)
 
     # Get the current time and calculate the time ttl seconds ago
     now = datetime.now()
     ttl = now - timedelta(seconds=seconds_ago)
 
-    # Query the 'trajectories' collection for documents where 'created_at' is not older than ttl seconds
-    recent_trajectories = trajectories.find({'created_at': {'$gte': ttl}})
+    # Reduce the documents not older than ttl seconds to the most recent one of each 'uav_id' on the server, so only
+    # one document per UAV is sent back. All stages are available in MongoDB 3.6
+    pipeline = [
+        {'$match': {'created_at': {'$gte': ttl}}},
+        {'$sort': {'created_at': -1}},  # walks the index backwards from the newest document
+        {'$group': {'_id': '$uav_id', 'trajectory': {'$first': '$$ROOT'}}},
+        {'$replaceRoot': {'newRoot': '$trajectory'}},
+        {'$project': LEAN_PROJECTION},
+    ]
 
-    # Create a dictionary to store the most recent trajectory of each 'uav_id'
-    recent_uav_trajectories = {}
+    # Return the most recent trajectories of each 'uav_id'
+    return lean_trajectories(trajectories.aggregate(pipeline, allowDiskUse=True, batchSize=SNAPSHOT_BATCH_SIZE))
 
-    # Iterate over the recent trajectories
-    for trajectory in recent_trajectories:
-        uav_id = trajectory['uav_id']
 
-        # If the 'uav_id' is not in the dictionary or the current trajectory is more recent, update the dictionary
-        if uav_id not in recent_uav_trajectories or trajectory['created_at'] > recent_uav_trajectories[uav_id][
-            'created_at']:
-            recent_uav_trajectories[uav_id] = trajectory
+def get_recent_bucketed_trajectories(seconds_ago):
+    """
+    Same as get_recent_trajectories, for the HISTORY_LAYOUT=buckets of update: one document per UAV and minute, its
+    reports in 'samples' and the time of the last one in 'created_at'. The scan covers the buckets written to within
+    seconds_ago, at most (seconds_ago / 60 + 1) per active UAV, whatever the report rate and history size.
+    """
+    trajectory_buckets = db.trajectory_buckets
+    ensure_recent_index(trajectory_buckets)
 
-    # Return the most recent trajectories of each 'uav_id'
-    return list(recent_uav_trajectories.values())
+    ttl = datetime.now() - timedelta(seconds=seconds_ago)
+    pipeline = [
+        {'$match': {'created_at': {'$gte': ttl}}},
+        {'$sort': {'created_at': -1}},
+        {'$group': {'_id': '$uav_id', 'bucket': {'$first': '$$ROOT'}}},
+        # the sample of the bucket's last report, samples of concurrent writers may be pushed out of order
+        {'$replaceRoot': {'newRoot': {'$arrayElemAt': [
+            {'$filter': {'input': '$bucket.samples', 'as': 'sample',
+                         'cond': {'$eq': ['$$sample.created_at', '$bucket.created_at']}}}, -1]}}},
+        {'$project': LEAN_PROJECTION},
+    ]
+    return lean_trajectories(trajectory_buckets.aggregate(pipeline, allowDiskUse=True, batchSize=SNAPSHOT_BATCH_SIZE))
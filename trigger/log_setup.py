@@ -0,0 +1,75 @@
+import atexit
+import logging
+import os
+import queue
+import reprlib
+from logging.handlers import QueueHandler, QueueListener
+
+from timestamp_for_logger import CustomFormatter
+
+# NOTE: the same module is in every function, keep them in sync
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL")  # the default level of the function if not set
+LOG_PAYLOAD_MAX_CHARS = int(os.environ.get("LOG_PAYLOAD_MAX_CHARS", 500))  # of a logged payload, after the summary
+LOG_PAYLOAD_MAX_IDS = int(os.environ.get("LOG_PAYLOAD_MAX_IDS", 20))  # uav_ids listed in the summary of a payload
+
+# bounds how much of a payload is walked to log it, so the cost does not grow with the fleet
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxlist = 5
+_payload_repr.maxdict = 12
+_payload_repr.maxstring = 80
+_payload_repr.maxother = 80
+
+
+def setup_logging(default_level="DEBUG"):
+    """
+    The calling thread builds the message of a record (QueueHandler.prepare), as the logged payloads are changed in
+    place afterwards, e.g. by flag_conflicts, and puts it on a queue. The thread of a QueueListener adds the time and
+    level (CustomFormatter, as milliseconds are not supported by default) and writes it, so invocations do not wait
+    for the output. The payloads are logged as a summary (see summarize), which keeps the part on the calling thread
+    bounded.
+    Returns:
+        the started QueueListener, it is stopped (and the queue flushed) at exit
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(CustomFormatter('%(asctime)s [%(levelname)s] %(message)s', '%H:%M:%S.%f'))
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel((LOG_LEVEL or default_level).upper())
+    return listener
+
+
+class PayloadSummary:
+    """
+    Log argument for a payload ({"data": [...], "meta": {...}} or a list of trajectories): the number of UAVs, the
+    first LOG_PAYLOAD_MAX_IDS uav_ids and a repr truncated to LOG_PAYLOAD_MAX_CHARS. Only built into a str if the
+    record is logged.
+    """
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        data = self.payload.get("data") if isinstance(self.payload, dict) else self.payload
+        text = _payload_repr.repr(self.payload)
+        if len(text) > LOG_PAYLOAD_MAX_CHARS:
+            text = text[:LOG_PAYLOAD_MAX_CHARS] + "..."
+        if not isinstance(data, list):
+            return text
+        uav_ids = [trajectory.get("uav_id") for trajectory in data[:LOG_PAYLOAD_MAX_IDS] if isinstance(trajectory, dict)]
+        more = ", ..." if len(data) > LOG_PAYLOAD_MAX_IDS else ""
+        return f'<{len(data)} UAVs: {", ".join(map(str, uav_ids))}{more}> {text}'
+
+
+def summarize(payload):
+    # e.g. logger.debug('Parsed input: %s', summarize(parsed_input))
+    return PayloadSummary(payload)
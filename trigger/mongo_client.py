@@ -0,0 +1,123 @@
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
+from opentelemetry import trace
+
+import metrics
+
+# NOTE: the same module is in trigger and update, keep them in sync
+
+MONGO_HOST = os.environ.get("MONGO_HOST", "172.17.0.1")
+MONGO_PORT = int(os.environ.get("MONGO_PORT", 27017))
+MONGO_DATABASE = os.environ.get("MONGO_DATABASE", "sixGNext")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 1))  # connections opened in the background
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 2000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 10000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 1000))  # wait for a free connection
+
+# Set up Python logger
+logger = logging.getLogger(__name__)
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    """
+    Adds an event with the latency of each Mongo command to the span that is current when it runs. pymongo calls the
+    listeners in the thread that runs the command, so that is the span of the calling function. The latency is also
+    recorded as the 'mongo' stage.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        trace.get_current_span().add_event("mongo_command", {
+            "command": event.command_name, "latency_ms": event.duration_micros / 1000, "ok": True})
+        metrics.STAGE_DURATION.record(event.duration_micros / 1000, {"stage": "mongo", "command": event.command_name})
+
+    def failed(self, event):
+        trace.get_current_span().add_event("mongo_command", {
+            "command": event.command_name, "latency_ms": event.duration_micros / 1000, "ok": False,
+            "failure": str(event.failure)})
+        metrics.STAGE_DURATION.record(event.duration_micros / 1000, {"stage": "mongo", "command": event.command_name})
+        metrics.record_error("mongo")
+
+
+class PoolWaitListener(monitoring.ConnectionPoolListener):
+    """
+    Adds an event with the time spent waiting for a connection from the pool to the current span, which grows when
+    more invocations run at once than MONGO_MAX_POOL_SIZE.
+    """
+
+    def __init__(self):
+        self._check_out_start = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._check_out_start.time = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        start = getattr(self._check_out_start, "time", None)
+        if start is not None:
+            trace.get_current_span().add_event("mongo_pool_checkout", {
+                "wait_ms": (time.perf_counter() - start) * 1000})
+
+    def connection_check_out_failed(self, event):
+        start = getattr(self._check_out_start, "time", None)
+        trace.get_current_span().add_event("mongo_pool_checkout", {
+            "wait_ms": (time.perf_counter() - start) * 1000 if start is not None else -1, "failed": True,
+            "reason": str(event.reason)})
+
+    # the other pool events are not of interest
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+# One client per process: it keeps a pool of connections and monitors the server, across invocations
+client = MongoClient(
+    host=MONGO_HOST,
+    port=MONGO_PORT,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[CommandLatencyListener(), PoolWaitListener()],
+)
+db = client[MONGO_DATABASE]
+
+
+def warm_up():
+    # discover the server and open the first connection before the first invocation, see fn's warm_up
+    start = time.perf_counter()
+    try:
+        client.admin.command('ping')
+        logger.info(f'[mongo client] connected to {MONGO_HOST}:{MONGO_PORT} in '
+                    f'{(time.perf_counter() - start) * 1000:.1f} ms')
+    except Exception as e:  # the invocations retry through the client, Mongo may just not be up yet
+        logger.warning(f'[mongo client] warm-up ping to {MONGO_HOST}:{MONGO_PORT} failed: {e}')
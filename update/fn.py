@@ -1,41 +1,68 @@
 #!/usr/bin/env python3
 
-import json
+import cold_start  # first, it marks when loading the function started
+import os
 import typing
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry import context
 
 from call_next_func import post_trigger
-from timestamp_for_logger import CustomFormatter
-from tracer import TracerInitializer
-from store_update import store_update
-from json_encoder import JSONEncoder
-
-# Set up Python logger. milliseconds are not supported by default
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%H:%M:%S.%f'
-)
+from log_setup import setup_logging, summarize
+from tracer import TracerInitializer, clip, extract_context, warm_up as warm_up_exporter
+import chain_client
+import mongo_client
+import metrics
+import wire_format
+from store_update import store_update, stamp_reports, write_reports, ensure_indexes
+
+# Set up Python logger. The level is LOG_LEVEL from ENV, the records are written off the request thread
+setup_logging()
 logger = logging.getLogger(__name__)
-for handler in logging.getLogger().handlers:  # Apply the custom formatter to the root logger
-    handler.setFormatter(CustomFormatter(handler.formatter._fmt, handler.formatter.datefmt))
 
 # Initialize the OpenTelemetry tracer
 tracer = TracerInitializer("update").tracer
 
-def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]: # NOTE: should not be parallelized with postTrigger, as it will read the write update() does
+# Initialize the OpenTelemetry metrics, exported to the same endpoint as the traces
+metrics.MetricsInitializer("update")
+INVOCATIONS = metrics.InvocationCounter()
+
+# the reports are passed on to trigger, so the write and the trigger call run at the same time. TRIGGER_AFTER_WRITE
+# calls trigger only once the write is acknowledged, as before
+TRIGGER_AFTER_WRITE = os.environ.get("TRIGGER_AFTER_WRITE", "false").lower() == "true"
+TRIGGER_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get("TRIGGER_POOL_WORKERS", 8)))
+
+
+def warm_up():
+    # opens the connections of the function before its first invocation, see cold_start.WARM_UP
+    warm_up_exporter()
+    metrics.warm_up()
+    chain_client.warm_up()
+    mongo_client.warm_up()
+    ensure_indexes()
+
+
+def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, str]]) -> typing.Optional[str]:
     """
     input: A JSON string of collection of new trajectories
     output: writes to the db, and may call trigger function
     """
-    with tracer.start_as_current_span('fn') as main_span:
-        main_span.set_attribute("invoke_count", Counter.increment_count())
-        main_span.set_attribute("input", input)
-        logger.info(f'[update fn] invoke count: {str(Counter.get_count())}')
-        # Parse the JSON string into a Python list of dictionaries
-        with tracer.start_as_current_span('parse_input'):
-            parsed_input = json.loads(input)
-            logger.debug(f'[update fn] Parsed input: {parsed_input}')
+    # the span continues the trace of the calling function, if it sent one
+    with tracer.start_as_current_span('fn', context=extract_context(headers)) as main_span:
+        cold_start.record_cold_start(main_span)
+        if cold_start.is_warm_up_request(headers):
+            cold_start.run_warm_up("update", warm_up)
+            return "warmed up"
+        invoke_count = INVOCATIONS.increment()
+        main_span.set_attribute("invoke_count", invoke_count)
+        main_span.set_attribute("input", clip(input))
+        main_span.set_attribute("input_length", len(input))
+        logger.info(f'[update fn] invoke count: {invoke_count}')
+        # Parse the payload (JSON, or the WIRE_FORMAT of the previous function) into a Python dictionary
+        with tracer.start_as_current_span('parse_input'), metrics.timed("parse"):
+            parsed_input = wire_format.decode(input, headers)
+            logger.debug('[update fn] Parsed input: %s', summarize(parsed_input))
 
             data = parsed_input.get('data', [])
             meta = parsed_input.get('meta', {})
@@ -45,6 +72,7 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
         if origin is None:
             logger.error(f'[update fn] No origin key found in meta')
             main_span.set_attribute("error", True)
+            metrics.record_error("fn")
             main_span.set_attribute("error_details", f'No origin key found in meta. dump: {meta}')
             return f'No origin key found in meta. dump: {meta}'
 
@@ -52,51 +80,63 @@ def fn(input: typing.Optional[str], headers: typing.Optional[typing.Dict[str, st
         with tracer.start_as_current_span('store_n_decide_to_trigger') as store_n_decide_span:
             store_n_decide_span.set_attribute("origin", origin)
             if origin == 'system':  # invoked by release()
-                logger.info(f'[update fn] will NOT call post_trigger() as it is from system. storing the released data. dump: {data}')
+                logger.info('[update fn] will NOT call post_trigger() as it is from system. storing the released data. dump: %s', summarize(data))
                 try: # NOTE: multiple trajectories can be released by the system
-                    store_update(data)  # IO operation
+                    write_batch_size = store_update(data).wait()  # IO operation
+                    store_n_decide_span.set_attribute("write_batch_size", write_batch_size)
                 except Exception as e:
                     logger.error(f'[update fn] Error in store_update: {e}')
                     store_n_decide_span.set_attribute("error", True)
+                    metrics.record_error("store_n_decide_to_trigger")
                     store_n_decide_span.set_attribute("error_details", e)
             elif origin == 'self_report':  # invoked by ingest
+                # NOTE: usually only one trajectory is reported, but data is a list
+                stamp_reports(data)
+                meta['changed_uav_ids'] = [element['uav_id'] for element in data]  # detector only re-checks these
+                trigger_future = None
+                if not TRIGGER_AFTER_WRITE:  # trigger merges the reports into the snapshot, it need not read them back
+                    logger.info('[update fn] Calling post_trigger with data and meta, while storing the reported data')
+                    trigger_future = TRIGGER_POOL.submit(post_trigger_in_context, context.get_current(), data, meta)
                 logger.info('[update fn] storing the reported data.')
-                try: # NOTE: usually only one trajectory is reported, but data is a list
-                    store_update(data)   # IO operation
+                try:
+                    write_batch_size = write_reports(data).wait()   # IO operation
+                    store_n_decide_span.set_attribute("write_batch_size", write_batch_size)
                 except Exception as e:
                     logger.error(f'[update fn] Error in store_update: {e}')
                     store_n_decide_span.set_attribute("error", True)
+                    metrics.record_error("store_n_decide_to_trigger")
                     store_n_decide_span.set_attribute("error_details", e)
-                logger.info('[update fn] Calling post_trigger with data and meta')
-                with tracer.start_as_current_span('post_trigger') as post_trigger_span:
-                    # json_serialiized_data = JSONEncoder().encode(data)  # after adding created_at as python timestamp
-                    try:
-                        post_trigger("", meta) # IO operation
-                    except Exception as e:
-                        logger.error(f'[update fn] Error in post_trigger: {e}')
-                        post_trigger_span.set_attribute("error", True)
-                        post_trigger_span.set_attribute("error_details", e)
+                    if trigger_future is None:
+                        return f'Error in store_update: {e}'  # trigger would not find the data
+                if trigger_future is None:
+                    logger.info('[update fn] Calling post_trigger with data and meta')
+                    post_trigger_in_context(context.get_current(), data, meta)
+                else:
+                    trigger_future.result()
             else:
                 logger.fatal(f'[update fn] Unknown origin: {origin}')
                 store_n_decide_span.set_attribute("error", True)
+                metrics.record_error("store_n_decide_to_trigger")
                 store_n_decide_span.set_attribute("error_details", f'Unknown origin: {origin}')
                 return f'Unknown origin: {origin}'
 
         return str(data)
 
 
-class Counter:
-    count = None
+def post_trigger_in_context(parent_context, data, meta):
+    # may run on TRIGGER_POOL, so the span is attached to the caller's span explicitly
+    token = context.attach(parent_context)
+    try:
+        with tracer.start_as_current_span('post_trigger') as post_trigger_span:
+            try:
+                post_trigger(data, meta)  # IO operation
+            except Exception as e:
+                logger.error(f'[update fn] Error in post_trigger: {e}')
+                post_trigger_span.set_attribute("error", True)
+                metrics.record_error("post_trigger")
+                post_trigger_span.set_attribute("error_details", e)
+    finally:
+        context.detach(token)
 
-    @staticmethod
-    def get_count():
-        if Counter.count is None:  # memoize
-            Counter.count = 0
-        return Counter.count
 
-    @staticmethod
-    def increment_count():
-        if Counter.count is None:
-            Counter.count = 0
-        Counter.count += 1
-        return Counter.count
+cold_start.loaded("update", warm_up)
@@ -1,23 +1,188 @@
-from pymongo import MongoClient
+import os
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne, ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.write_concern import WriteConcern
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
 
-# Create a MongoClient to the running MongoDB instance
-host = "172.17.0.1"  # TODO use ENV variables
-client = MongoClient(f'mongodb://{host}:27017/')
+from mongo_client import db
+from write_behind import WriteBehindBuffer, WriteTicket
 
-# Access the 'trajectories' collection in the 'sixGNext' database
-db = client.sixGNext
-trajectories = db.trajectories
+DUPLICATE_KEY_ERROR = 11000
+INDEX_OPTIONS_CONFLICT = 85
 
-def store_update(data):
+# 'documents' (default) stores one document per report, 'buckets' one document per UAV and minute with the reports of
+# that minute in 'samples', which keeps the index small and turns most inserts into an in-place $push
+HISTORY_LAYOUT = os.environ.get("HISTORY_LAYOUT", "documents")
+if HISTORY_LAYOUT not in ("documents", "buckets"):
+    raise ValueError(f'Unknown HISTORY_LAYOUT: {HISTORY_LAYOUT}. Expected one of {["documents", "buckets"]}')
+# if > 0, Mongo removes history documents (buckets) this many seconds after their (last) created_at
+HISTORY_TTL_SECONDS = int(os.environ.get("HISTORY_TTL_SECONDS", 0))
+# with WRITE_BEHIND, the reports of concurrent invocations are collected for up to WRITE_BEHIND_MAX_DELAY_MS or
+# WRITE_BEHIND_MAX_DOCUMENTS documents and written together
+WRITE_BEHIND = os.environ.get("WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_MAX_DOCUMENTS = int(os.environ.get("WRITE_BEHIND_MAX_DOCUMENTS", 100))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.environ.get("WRITE_BEHIND_MAX_DELAY_MS", 5))
+# acknowledgement the writes wait for: WRITE_CONCERN_W is a number of nodes or 'majority', WRITE_CONCERN_J waits for the
+# journal. The default (1, false) is the acknowledgement of the primary, as before
+WRITE_CONCERN_W = os.environ.get("WRITE_CONCERN_W", "1")
+WRITE_CONCERN = WriteConcern(w=int(WRITE_CONCERN_W) if WRITE_CONCERN_W.isdigit() else WRITE_CONCERN_W,
+                             j=os.environ.get("WRITE_CONCERN_J", "false").lower() == "true")
+
+# Access the 'trajectories' collection through the pooled client of the process
+trajectories = db.get_collection('trajectories', write_concern=WRITE_CONCERN)
+# the reports of one UAV in one minute, for HISTORY_LAYOUT=buckets
+trajectory_buckets = db.get_collection('trajectory_buckets', write_concern=WRITE_CONCERN)
+# the most recent report of each UAV, so trigger reads O(active UAVs) documents instead of the history
+latest_state = db.get_collection('latest_state', write_concern=WRITE_CONCERN)
+history = trajectory_buckets if HISTORY_LAYOUT == 'buckets' else trajectories
+_indexes_ensured = False
+
+
+def ensure_ttl_index(collection, expire_after_seconds):
+    # a TTL index has to be on a single field, so it is separate from the compound index trigger reads with
+    try:
+        collection.create_index([('created_at', ASCENDING)], name='created_at_ttl',
+                                expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        # the index exists with another expiry, change it in place (supported since MongoDB 2.2)
+        db.command('collMod', collection.name,
+                   index={'name': 'created_at_ttl', 'expireAfterSeconds': expire_after_seconds})
+
+
+def ensure_indexes():
+    # once per process, by the warm-up or the first write, so loading the function does not wait for Mongo
+    global _indexes_ensured
+    if _indexes_ensured:
+        return
+    latest_state.create_index([('uav_id', ASCENDING)], unique=True, name='uav_id_1')
+    latest_state.create_index([('created_at', DESCENDING)], name='created_at_-1')
+    latest_state.create_index([('location', GEOSPHERE)], name='location_2dsphere')  # for trigger's neighbourhood query
+    if HISTORY_LAYOUT == 'buckets':
+        trajectory_buckets.create_index([('uav_id', ASCENDING), ('bucket_start', ASCENDING)], unique=True,
+                                        name='uav_id_1_bucket_start_1')
+    if HISTORY_TTL_SECONDS > 0:
+        ensure_ttl_index(history, HISTORY_TTL_SECONDS)
+    _indexes_ensured = True
+
+
+def bucket_upserts(data):
+    """
+    Args:
+        data: the reports to store, with their 'created_at' and '_id'
+
+    Returns:
+        one UpdateOne per report, appending it to the bucket of its UAV and minute (created if it does not exist)
+    """
+    operations = []
+    for element in data:
+        bucket_start = element['created_at'].replace(second=0, microsecond=0)
+        operations.append(UpdateOne(
+            {'uav_id': element['uav_id'], 'bucket_start': bucket_start},
+            {'$push': {'samples': element},
+             '$inc': {'count': 1},
+             '$max': {'created_at': element['created_at']}},  # the last sample, for the hot query and the TTL
+            upsert=True))
+    return operations
+
+
+def only_duplicate_keys(bulk_write_error):
+    # whether all errors of the bulk write are duplicate keys on a unique index, the expected outcome of losing an upsert
+    details = bulk_write_error.details
+    return not details.get('writeConcernErrors') and all(error['code'] == DUPLICATE_KEY_ERROR
+                                                          for error in details['writeErrors'])
+
+
+def geojson_point(latitude, longitude):
+    # GeoJSON orders longitude first, and the 2dsphere index rejects coordinates out of range
+    return {'type': 'Point', 'coordinates': [(longitude + 180) % 360 - 180, max(-90.0, min(90.0, latitude))]}
+
+
+def latest_state_upserts(data):
+    """
+    Args:
+        data: the stored reports, with the '_id' of their history document
+
+    Returns:
+        one ReplaceOne per report, replacing the UAV's latest state unless a newer report is already there
+    """
+    operations = []
+    for element in data:
+        state = {key: value for key, value in element.items() if key != '_id'}
+        state['trajectory_id'] = element['_id']  # the history document the state was copied from
+        state['location'] = geojson_point(element['latitude'], element['longitude'])
+        # a newer report of the same UAV does not match the filter, then the upsert hits the unique uav_id index and
+        # fails with a duplicate key error, which leaves the newer state in place
+        operations.append(ReplaceOne({'uav_id': element['uav_id'], 'created_at': {'$lte': element['created_at']}},
+                                     state, upsert=True))
+    return operations
+
+
+def write_documents(data):
+    """
+    Writes the stamped reports to the history and to 'latest_state', with unordered bulk writes
+    """
+    ensure_indexes()
+    if HISTORY_LAYOUT == 'buckets':
+        operations = bucket_upserts(data)
+        try:
+            trajectory_buckets.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # two writers upserting the same new bucket race on the unique index, the loser retries as an update
+            if not only_duplicate_keys(e):
+                raise
+            trajectory_buckets.bulk_write([operations[error['index']] for error in e.details['writeErrors']],
+                                          ordered=False)
+    else:
+        # Insert all elements of the data into the 'trajectories' collection at once
+        trajectories.insert_many(data, ordered=False)
+        # for element in data:
+        #     trajectories.insert_one(element)
+
+    # Then upsert them into 'latest_state'. A bulk write is bound to one collection, so this is a second round trip
+    try:
+        latest_state.bulk_write(latest_state_upserts(data), ordered=False)
+    except BulkWriteError as e:
+        if not only_duplicate_keys(e):
+            raise
+
+
+write_behind = WriteBehindBuffer(write_documents, WRITE_BEHIND_MAX_DOCUMENTS, WRITE_BEHIND_MAX_DELAY_MS / 1000) \
+    if WRITE_BEHIND else None
+
+
+def stamp_reports(data):
+    """
+    Adds 'created_at' and a new '_id' to all 'data' elements, so they are complete before they are written and can be
+    passed on to trigger at the same time
+    """
     # Add a 'created_at' key to all 'data' elements with the current timestamp
     created_time = datetime.now()
     for element in data:
         element['created_at'] = created_time
-        # in case of mutated release, let mongo generate the _id and not a duplicate of original id
-        element.pop('_id', None)
+        # in case of mutated release, a new _id and not a duplicate of original id. It is generated here rather than by
+        # the driver, also as Mongo only generates the _id of whole documents and not of bucket samples
+        element['_id'] = ObjectId()
+
 
-    # Insert all elements of the data into the 'trajectories' collection at once
-    trajectories.insert_many(data)
-    # for element in data:
-    #     trajectories.insert_one(element)
\ No newline at end of file
+def write_reports(data):
+    """
+    Returns:
+        a WriteTicket, whose wait() returns once the stamped data is written with the configured write concern (or
+        raises the error of the write). Without WRITE_BEHIND, the data is already written when write_reports returns.
+    """
+    if write_behind is not None:
+        return write_behind.submit(data)
+    write_documents(data)
+    return WriteTicket.written(len(data))
+
+
+def store_update(data):
+    """
+    Stamps and writes the data, see write_reports
+    """
+    stamp_reports(data)
+    return write_reports(data)
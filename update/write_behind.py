@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+# Set up Python logger
+logger = logging.getLogger(__name__)
+
+
+class WriteTicket:
+    """
+    Handed out for each submitted batch of documents, wait() blocks until the write that contains them is done.
+    """
+    __slots__ = ("_done", "error", "batch_size")
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+        self.batch_size = None  # number of documents written together with this batch
+
+    @classmethod
+    def written(cls, batch_size):
+        ticket = cls()
+        ticket.set_done(batch_size)
+        return ticket
+
+    def set_done(self, batch_size, error=None):
+        self.batch_size = batch_size
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Returns:
+            the number of documents of the write. Raises the error of the write, or TimeoutError
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f'write not done after {timeout} s')
+        if self.error is not None:
+            raise self.error
+        return self.batch_size
+
+
+class WriteBehindBuffer:
+    """
+    Collects the documents of concurrent invocations and writes them in one go from a background thread, once
+    max_documents are pending or the oldest pending document waited for max_delay_seconds.
+    """
+
+    def __init__(self, write, max_documents, max_delay_seconds):
+        # write: function writing a list of documents, raising on failure
+        self.write = write
+        self.max_documents = max_documents
+        self.max_delay_seconds = max_delay_seconds
+        self._condition = threading.Condition()
+        self._pending = []  # (documents, ticket)
+        self._pending_documents = 0
+        self._first_pending_at = None
+        self._thread = None
+
+    def submit(self, documents):
+        ticket = WriteTicket()
+        with self._condition:
+            if self._thread is None:  # started on first use, not at import
+                self._thread = threading.Thread(target=self._flush_forever, name='write-behind', daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending.append((documents, ticket))
+            self._pending_documents += len(documents)
+            self._condition.notify()
+        return ticket
+
+    def _take_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._first_pending_at + self.max_delay_seconds
+            while self._pending_documents < self.max_documents:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            # at most max_documents (but whole submissions), the rest goes into the next write right away
+            taken, documents = 0, 0
+            while taken < len(self._pending) and documents < self.max_documents:
+                documents += len(self._pending[taken][0])
+                taken += 1
+            batch, self._pending = self._pending[:taken], self._pending[taken:]
+            self._pending_documents -= documents
+            return batch
+
+    def _flush_forever(self):
+        while True:
+            batch = self._take_batch()
+            documents = [document for batch_documents, _ in batch for document in batch_documents]
+            error = None
+            try:
+                self.write(documents)
+            except Exception as e:
+                logger.error(f'[write behind] Error writing {len(documents)} documents: {e}')
+                error = e
+            for _, ticket in batch:
+                ticket.set_done(len(documents), error)